@@ -25,6 +25,7 @@ def initialize(project):
     project.depends_on('databricks_cli')
     project.depends_on('Jinja2')
     project.depends_on('boto3')
+    project.build_depends_on('moto')
     """Build setting"""
     project.set_property('distutils_commands', ['sdist', 'bdist_wheel'])
     project.set_property('distutils_classifiers', ['Development Status :: 5 - Production/Stable'])
@@ -0,0 +1,441 @@
+"""
+Offline benchmark of the deployment tasks of databricks_pybuilder_plugin.
+
+The package is kept apart from the plugin, which imports it by the deploy_benchmark task only.
+The tasks are run against an in-process fake of the Databricks REST api (workspace, dbfs, jobs, clusters and
+libraries endpoints) and, if moto is installed, an in-process s3 stand-in.
+Latency, bandwidth and error rate of the fakes are configurable, synthetic project trees are generated per scenario.
+"""
+import base64
+import io
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+SCENARIOS = {
+    'small': {'files': 10, 'large_files': 0, 'large_file_size': 0, 'jobs': 5, 'clusters': 1},
+    'medium': {'files': 1000, 'large_files': 2, 'large_file_size': 16 * 1024 * 1024, 'jobs': 50, 'clusters': 2},
+    'large': {'files': 10000, 'large_files': 3, 'large_file_size': 64 * 1024 * 1024, 'jobs': 500, 'clusters': 4},
+}
+
+BENCHMARK_ENV = 'benchmark'
+BENCHMARK_CLUSTER_NAME = 'benchmark_cluster'
+BENCHMARK_BUCKET = 'databricks-pybuilder-benchmark'
+
+
+class FakeDatabricksServer:
+    """
+    A local http server emulating the subset of the Databricks REST api used by the plugin.
+    Every request is delayed by the latency plus the transfer time of its body, a share of requests
+    defined by the error rate is rejected with the 503 status.
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None, error_rate=0.0, cluster_start_time=1.0, jobs=(), clusters=1):
+        self.latency = float(latency or 0)
+        self.bandwidth = float(bandwidth) if bandwidth else None
+        self.error_rate = float(error_rate or 0)
+        self.cluster_start_time = float(cluster_start_time)
+        self.request_count = 0
+        self.error_count = 0
+        self.workspace = {'/': 'DIRECTORY'}
+        self.dbfs = {'/': None}
+        self.dbfs_handles = {}
+        self.last_dbfs_handle = 0
+        self.jobs = {job_id: {'job_id': job_id, 'settings': {'name': name}} for job_id, name in enumerate(jobs, 1)}
+        cluster_names = [BENCHMARK_CLUSTER_NAME] + [f'{BENCHMARK_CLUSTER_NAME}_{index}' for index in range(2, clusters + 1)]
+        self.clusters = {f'{name.replace("_", "-")}-id': {'cluster_id': f'{name.replace("_", "-")}-id',
+                                                          'cluster_name': name, 'state': 'TERMINATED'}
+                         for name in cluster_names}
+        self.cluster_started_at = {}
+        self.libraries = {cluster_id: [] for cluster_id in self.clusters}
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def host(self):
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self._handle(parse_qs(urlparse(self.path).query))
+
+            def do_POST(self):
+                self._handle(None)
+
+            def _handle(self, query):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+                status, response = server.handle(self.command, urlparse(self.path).path, query, body,
+                                                 self.headers.get('Content-Type', ''))
+                payload = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                if status == 503:
+                    self.send_header('Retry-After', '0')
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def handle(self, method, path, query, body, content_type):
+        with self._lock:
+            self.request_count += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.error_count += 1
+
+        time.sleep(self.latency + (len(body) / self.bandwidth if self.bandwidth else 0))
+        if failed:
+            return 503, {'error_code': 'TEMPORARILY_UNAVAILABLE', 'message': 'Injected failure.'}
+
+        if query is not None:
+            data = {key: values[0] for key, values in query.items()}
+        elif content_type.startswith('multipart/form-data'):
+            # the file part is skipped as its disposition holds a file name as well
+            data = {name.decode(): value.decode()
+                    for name, value in re.findall(rb'name="(\w+)"\r\n\r\n(.*?)\r\n--', body, re.DOTALL)}
+        else:
+            data = json.loads(body or b'{}')
+
+        endpoint = re.sub(r'^/api/[^/]+', '', path)
+        with self._lock:
+            return self._dispatch(endpoint, data)
+
+    def _import_directory(self, path, content):
+        self.workspace[path] = 'DIRECTORY'
+        if not zipfile.is_zipfile(io.BytesIO(content)):
+            return
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            for name in archive.namelist():
+                # the archive holds the directory itself as the root entry, notebooks lose their extensions
+                relative_path = os.path.splitext(name.split('/', 1)[-1])[0]
+                parent = path
+                for directory in relative_path.split('/')[:-1]:
+                    parent = f'{parent}/{directory}'
+                    self.workspace[parent] = 'DIRECTORY'
+                self.workspace[f'{path}/{relative_path}'] = 'NOTEBOOK'
+
+    def _dispatch(self, endpoint, data):
+        # the dbfs api accepts the scheme prefix, but lists absolute paths without it
+        if endpoint.startswith('/dbfs/') and str(data.get('path', '')).startswith('dbfs:'):
+            data['path'] = data['path'][len('dbfs:'):]
+        if endpoint == '/workspace/mkdirs':
+            # the parent directories are created as well
+            for directory in _parent_paths(data['path']):
+                self.workspace.setdefault(directory, 'DIRECTORY')
+        elif endpoint == '/workspace/import':
+            content = base64.b64decode(data.get('content', ''))
+            if data.get('format', 'SOURCE') == 'SOURCE' and not zipfile.is_zipfile(io.BytesIO(content)):
+                self.workspace[data['path']] = 'NOTEBOOK'
+            elif data['path'] in self.workspace:
+                # an archive holds a directory, it can't be imported onto an existing path even with the overwrite
+                return 400, {'error_code': 'RESOURCE_ALREADY_EXISTS', 'message': f'Path ({data["path"]}) already exists.'}
+            else:
+                self._import_directory(data['path'], content)
+        elif endpoint in ('/workspace/delete', '/dbfs/delete') \
+                and data['path'].rstrip('/') not in (self.workspace if endpoint == '/workspace/delete' else self.dbfs):
+            return 404, {'error_code': 'RESOURCE_DOES_NOT_EXIST', 'message': data['path']}
+        elif endpoint == '/workspace/delete':
+            removed_paths = [path for path in self.workspace if f'{path}/'.startswith(data['path'] + '/')]
+            for path in removed_paths:
+                del self.workspace[path]
+        elif endpoint == '/workspace/get-status':
+            if data['path'] not in self.workspace:
+                return 404, {'error_code': 'RESOURCE_DOES_NOT_EXIST', 'message': data['path']}
+            return 200, {'path': data['path'], 'object_type': self.workspace[data['path']]}
+        elif endpoint == '/workspace/list':
+            prefix = data['path'].rstrip('/') + '/'
+            return 200, {'objects': [{'path': path, 'object_type': object_type, 'object_id': hash(path)}
+                                     for path, object_type in self.workspace.items()
+                                     if path.startswith(prefix) and '/' not in path[len(prefix):]]}
+        elif endpoint == '/dbfs/mkdirs':
+            for directory in _parent_paths(data['path']):
+                self.dbfs.setdefault(directory, None)
+        elif endpoint == '/dbfs/get-status':
+            if data['path'] not in self.dbfs:
+                return 404, {'error_code': 'RESOURCE_DOES_NOT_EXIST', 'message': data['path']}
+            size = self.dbfs[data['path']]
+            return 200, {'path': data['path'], 'is_dir': size is None, 'file_size': size or 0}
+        elif endpoint == '/dbfs/list':
+            prefix = data['path'].rstrip('/') + '/'
+            return 200, {'files': [{'path': path, 'is_dir': size is None, 'file_size': size or 0}
+                                   for path, size in self.dbfs.items()
+                                   if path.startswith(prefix) and '/' not in path[len(prefix):]]}
+        elif endpoint == '/dbfs/put':
+            self.dbfs[data['path']] = len(data.get('contents', ''))
+        elif endpoint == '/dbfs/create':
+            self.last_dbfs_handle += 1
+            self.dbfs_handles[self.last_dbfs_handle] = [data['path'], 0]
+            return 200, {'handle': self.last_dbfs_handle}
+        elif endpoint == '/dbfs/add-block':
+            self.dbfs_handles[data['handle']][1] += len(base64.b64decode(data['data']))
+        elif endpoint == '/dbfs/close':
+            path, size = self.dbfs_handles.pop(data['handle'])
+            self.dbfs[path] = size
+        elif endpoint == '/dbfs/delete':
+            removed_paths = [path for path in self.dbfs if f'{path}/'.startswith(data['path'] + '/')]
+            for path in removed_paths:
+                del self.dbfs[path]
+        elif endpoint == '/jobs/list':
+            offset, limit = int(data.get('offset', 0)), int(data.get('limit', 25))
+            jobs = list(self.jobs.values())
+            return 200, {'jobs': jobs[offset:offset + limit], 'has_more': offset + limit < len(jobs)}
+        elif endpoint in ('/jobs/get', '/jobs/reset') and int(data['job_id']) not in self.jobs:
+            return 400, {'error_code': 'INVALID_PARAMETER_VALUE', 'message': f'Job {data["job_id"]} does not exist.'}
+        elif endpoint == '/jobs/get':
+            return 200, self.jobs[int(data['job_id'])]
+        elif endpoint == '/jobs/reset':
+            self.jobs[int(data['job_id'])]['settings'] = data['new_settings']
+        elif endpoint.startswith(('/clusters/', '/libraries/')) and endpoint != '/clusters/list' \
+                and data.get('cluster_id') not in self.clusters:
+            return 400, {'error_code': 'INVALID_PARAMETER_VALUE', 'message': f'Cluster {data.get("cluster_id")} does not exist'}
+        elif endpoint == '/clusters/list':
+            return 200, {'clusters': [self._cluster_state(cluster_id) for cluster_id in self.clusters]}
+        elif endpoint == '/clusters/get':
+            return 200, self._cluster_state(data['cluster_id'])
+        elif endpoint in ('/clusters/start', '/clusters/restart'):
+            self.cluster_started_at[data['cluster_id']] = time.monotonic()
+            self.clusters[data['cluster_id']]['state'] = 'PENDING' if endpoint == '/clusters/start' else 'RESTARTING'
+        elif endpoint == '/libraries/cluster-status':
+            return 200, {'cluster_id': data['cluster_id'], 'library_statuses': self.libraries[data['cluster_id']]}
+        elif endpoint == '/libraries/install':
+            self.libraries[data['cluster_id']].extend({'library': library, 'status': 'INSTALLED'}
+                                                      for library in data['libraries'])
+        elif endpoint == '/libraries/uninstall':
+            for library in self.libraries[data['cluster_id']]:
+                if library['library'] in data['libraries']:
+                    library['status'] = 'UNINSTALL_ON_RESTART'
+        else:
+            return 404, {'error_code': 'ENDPOINT_NOT_FOUND', 'message': endpoint}
+
+        return 200, {}
+
+    def _cluster_state(self, cluster_id):
+        cluster = self.clusters[cluster_id]
+        started_at = self.cluster_started_at.get(cluster_id)
+        if cluster['state'] != 'RUNNING' and started_at is not None \
+                and time.monotonic() - started_at >= self.cluster_start_time:
+            cluster['state'] = 'RUNNING'
+            # libraries pending uninstall are removed once the cluster is (re)started
+            self.libraries[cluster_id] = [library for library in self.libraries[cluster_id]
+                                          if library['status'] != 'UNINSTALL_ON_RESTART']
+        return dict(cluster)
+
+
+def _parent_paths(path):
+    parts = path.rstrip('/').split('/')
+    return ['/'.join(parts[:index]) for index in range(2, len(parts) + 1)]
+
+
+def generate_project(basedir, files, large_files, large_file_size, jobs, project_name='benchmark_project'):
+    """
+    Generates a synthetic project tree: notebooks spread over nested directories, small and large resources,
+    a job definition file and a built whl archive.
+    """
+    scripts_dir = os.path.join(basedir, 'src', 'main', 'scripts')
+    resources_dir = os.path.join(basedir, 'src', 'main', 'resources')
+    for index in range(files):
+        directory = os.path.join(scripts_dir, f'module_{index % 10}', f'package_{index % 100 // 10}')
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'notebook_{index}.py'), 'w') as file:
+            file.write(f'# Databricks notebook source\nprint("notebook {index}")\n' + '# padding\n' * 50)
+
+    os.makedirs(resources_dir, exist_ok=True)
+    for index in range(max(1, files // 10)):
+        with open(os.path.join(resources_dir, f'resource_{index}.csv'), 'w') as file:
+            file.write('id,value\n' + ''.join(f'{row},{row * index}\n' for row in range(100)))
+    for index in range(large_files):
+        with open(os.path.join(resources_dir, f'blob_{index}.bin'), 'wb') as file:
+            for _ in range(0, large_file_size, 1024 * 1024):
+                file.write(os.urandom(1024 * 1024))
+
+    job_names = [f'benchmark_job_{index}' for index in range(jobs)]
+    os.makedirs(os.path.join(basedir, 'src', 'main', 'databricks'), exist_ok=True)
+    with open(os.path.join(basedir, 'src', 'main', 'databricks', 'job_settings.json'), 'w') as file:
+        json.dump([{'name': job_name,
+                    'tasks': [{'task_key': 'main',
+                               'notebook_task': {'notebook_path': '{{ remote_workspace_path }}/module_0/notebook'},
+                               'libraries': [{'whl': '{{ archive_path }}'}]}],
+                    'tags': {'env': '{{ env }}', 'branch': '{{ branch }}'}} for job_name in job_names], file, indent=2)
+
+    os.makedirs(os.path.join(basedir, 'target', 'dist', 'dist'), exist_ok=True)
+    with open(os.path.join(basedir, 'target', 'dist', 'dist', f'{project_name}-1.0.0-py3-none-any.whl'), 'wb') as file:
+        file.write(os.urandom(256 * 1024))
+
+    return job_names
+
+
+class S3StandIn:
+    """
+    An in-process s3 stand-in based on moto, delaying the requests by the latency and the transfer time.
+    """
+
+    def __init__(self, latency, bandwidth):
+        self.latency = float(latency or 0)
+        self.bandwidth = float(bandwidth) if bandwidth else None
+        self._mock = None
+        self._default_session = None
+
+    @staticmethod
+    def is_available():
+        try:
+            import moto  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def __enter__(self):
+        import boto3
+        from moto import mock_aws
+
+        self._mock = mock_aws()
+        self._mock.start()
+        # the clients of the tasks are created by the default session, it's replaced for the time of the benchmark
+        # so neither the environment nor the user's session are changed
+        self._default_session = boto3.DEFAULT_SESSION
+        boto3.setup_default_session(aws_access_key_id='benchmark', aws_secret_access_key='benchmark',
+                                    region_name='us-east-1')
+        boto3.DEFAULT_SESSION.events.register('before-sign.s3', self._delay)
+        boto3.client('s3').create_bucket(Bucket=BENCHMARK_BUCKET)
+        return self
+
+    def __exit__(self, *args):
+        import boto3
+
+        self._mock.stop()
+        boto3.DEFAULT_SESSION = self._default_session
+
+    def _delay(self, request=None, **kwargs):
+        body = getattr(request, 'body', None)
+        size = len(body) if isinstance(body, (bytes, str)) else 0
+        time.sleep(self.latency + (size / self.bandwidth if self.bandwidth else 0))
+
+
+class _BenchmarkLogger:
+    """
+    Keeps the log messages of the benchmarked tasks quiet, only errors are forwarded.
+    """
+
+    def __init__(self, logger):
+        self._logger = logger
+
+    def debug(self, message, *args):
+        pass
+
+    def info(self, message, *args):
+        pass
+
+    def warn(self, message, *args):
+        pass
+
+    def error(self, message, *args):
+        self._logger.error(message, *args)
+
+
+def run_scenario(plugin, scenario_name, scenario, logger, latency=0.0, bandwidth=None, error_rate=0.0,
+                 property_overrides=None, trace_memory=True):
+    """
+    Generates the scenario project, runs the deployment tasks against the fakes
+    and returns the wall time, request count and peak memory of every task.
+    """
+    from pybuilder.core import Project
+
+    basedir = tempfile.mkdtemp(prefix=f'databricks_benchmark_{scenario_name}_')
+    try:
+        job_names = generate_project(basedir, scenario['files'], scenario['large_files'],
+                                     scenario['large_file_size'], scenario['jobs'])
+        project = Project(basedir, name='benchmark_project')
+        plugin.initialize(project)
+        with FakeDatabricksServer(latency, bandwidth, error_rate, jobs=job_names,
+                                  clusters=scenario.get('clusters', 1)) as server:
+            project.set_property('dir_target', 'target')
+            project.set_property('dir_dist', 'target/dist')
+            project.set_property('databricks_credentials', {BENCHMARK_ENV: {'host': server.host, 'token': 'benchmark'}})
+            project.set_property('env', BENCHMARK_ENV)
+            project.set_property('branch', 'benchmark')
+            project.set_property('project_workspace_path', os.path.join(basedir, 'src', 'main', 'scripts') + os.sep)
+            project.set_property('project_resources_path', os.path.join(basedir, 'src', 'main', 'resources') + os.sep)
+            project.set_property('remote_workspace_path', '/benchmark/{env}')
+            project.set_property('with_dbfs_resources', True)
+            project.set_property('dbfs_resources_path', 'dbfs:/FileStore/benchmark/{env}')
+            project.set_property('remote_cluster_name', f'{BENCHMARK_CLUSTER_NAME}*')
+            project.set_property('attachable_lib_path', '/Volumes/benchmark/libs/{env}/{branch}')
+            project.set_property('attachable_lib_s3_path', f's3://{BENCHMARK_BUCKET}/libs/{{env}}/{{branch}}/')
+            project.set_property('attachable_lib_envs', [BENCHMARK_ENV])
+            project.set_property('cluster_poll_interval', 0.1)
+            project.set_property('cluster_poll_max_interval', 0.5)
+            project.set_property('deploy_report_path', 'target/reports')
+            for name, value in (property_overrides or {}).items():
+                project.set_property(name, value)
+
+            tasks = [('export_workspace', plugin.export_workspace), ('export_resources', plugin.export_resources)]
+            s3_stand_in = S3StandIn(latency, bandwidth) if S3StandIn.is_available() else None
+            if s3_stand_in is not None:
+                tasks += [('deploy_job', plugin.deploy_job), ('install_library', plugin.install_library)]
+            else:
+                logger.warn('moto is not installed: the s3 dependent tasks deploy_job and install_library are skipped.')
+
+            results = []
+            task_logger = _BenchmarkLogger(logger)
+            with s3_stand_in or nullcontext():
+                for task_name, task_function in tasks:
+                    results.append(_measure_task(server, task_name, lambda: task_function(project, task_logger),
+                                                 trace_memory))
+
+        return {'scenario': scenario_name, 'settings': dict(scenario, latency=latency, bandwidth=bandwidth,
+                                                            error_rate=error_rate),
+                'properties': property_overrides or {}, 'tasks': results}
+    finally:
+        shutil.rmtree(basedir, ignore_errors=True)
+
+
+def _measure_task(server, task_name, run_task, trace_memory):
+    request_count, error_count = server.request_count, server.error_count
+    if trace_memory:
+        tracemalloc.start()
+    start_time = time.monotonic()
+    error = None
+    try:
+        run_task()
+    except Exception as e:
+        error = str(e)
+    wall_time = time.monotonic() - start_time
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {'task': task_name, 'wall_time': wall_time, 'requests': server.request_count - request_count,
+            'injected_errors': server.error_count - error_count, 'peak_memory': peak_memory, 'error': error}
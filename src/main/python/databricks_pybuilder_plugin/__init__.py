@@ -1,14 +1,32 @@
+import asyncio
+import csv
 import fileinput
+import hashlib
+import io
 import os
+import queue
 import re
 import time
 import sys
 import json
+import mmap
+import random
+import threading
+import zipfile
 
 import boto3
+import requests
 
+from base64 import b64encode
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager, nullcontext
+from fnmatch import fnmatch, fnmatchcase
 from pathlib import Path
-from jinja2 import Template
+from urllib.parse import urlparse
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
 from databricks_cli.clusters.api import ClusterApi
 from databricks_cli.dbfs.api import DbfsApi
@@ -16,10 +34,12 @@ from databricks_cli.dbfs.dbfs_path import DbfsPath
 from databricks_cli.jobs.api import JobsApi
 from databricks_cli.libraries.api import LibrariesApi
 from databricks_cli.sdk import ApiClient
+from databricks_cli.sdk.api_client import TlsV1HttpAdapter
 from databricks_cli.workspace.api import WorkspaceApi
 
 from pybuilder.core import init, task, depends
 from pybuilder.utils import assert_can_execute
+from urllib3.util.retry import Retry
 
 
 __author__ = 'Mikhail Kavaliou'
@@ -46,9 +66,63 @@ def initialize(project):
     project.set_property('env_config_name', 'env')
     project.set_property('project_resources_path', 'src/main/resources/')
     project.set_property('job_definition_path', 'src/main/databricks/job_settings.json')
+    project.set_property('job_template_cache_path', '$dir_target/databricks_templates')
     project.set_property('attachable_lib_envs', ['dev'])
     project.set_property('clean_attachable_lib', False)
     project.set_property('cluster_init_timeout', 5 * 60)
+    project.set_property('cluster_poll_interval', 2)
+    project.set_property('cluster_poll_max_interval', 30)
+    project.set_property('parallel_install_stages', False)
+    project.set_property('wait_for_library_install', False)
+    project.set_property('skip_unchanged_library', True)
+    project.set_property('installed_libraries_path', '$dir_target/databricks_libraries.json')
+    project.set_property('library_install_timeout', 10 * 60)
+    project.set_property('envs', None)
+    project.set_property('deploy_engine', 'threads')
+    project.set_property('async_concurrency', 32)
+    project.set_property('databricks_api_pool_size', None)
+    project.set_property('databricks_api_retries', 6)
+    project.set_property('databricks_api_rate_limit', None)
+    project.set_property('deploy_report_path', '$dir_target/reports/databricks_deploy')
+    project.set_property('benchmark_scenarios', ['small'])
+    project.set_property('benchmark_latency', 0.02)
+    project.set_property('benchmark_bandwidth', None)
+    project.set_property('benchmark_error_rate', 0.0)
+    project.set_property('benchmark_properties', None)
+    project.set_property('benchmark_report_path', '$dir_target/reports/databricks_benchmark')
+    project.set_property('benchmark_baseline_path', None)
+    project.set_property('benchmark_tolerance', 0.2)
+    project.set_property('workspace_upload_workers', 1)
+    project.set_property('workspace_bulk_import', False)
+    project.set_property('workspace_archive_max_size', 10 * 1024 * 1024)
+    project.set_property('incremental_sync', False)
+    project.set_property('force_full', False)
+    project.set_property('delete_removed_files', False)
+    project.set_property('sync_manifest_path', '$dir_target/databricks_sync')
+    project.set_property('state_cache', False)
+    project.set_property('state_cache_path', '$dir_target/databricks_state.json')
+    project.set_property('state_cache_ttl', 60 * 60)
+    project.set_property('checkpoint_journal', True)
+    project.set_property('checkpoint_journal_path', '$dir_target/databricks_journal')
+    project.set_property('resume', False)
+    project.set_property('upload_include_patterns', None)
+    project.set_property('upload_exclude_patterns', ['__pycache__', '*.pyc', '.ipynb_checkpoints', '.DS_Store',
+                                                     '*.swp', '*~', '.#*'])
+    project.set_property('scan_prefetch_size', 1000)
+    project.set_property('prune_workers', 1)
+    project.set_property('prune_dry_run', False)
+    project.set_property('prune_active_branches', None)
+    project.set_property('dbfs_upload_workers', 1)
+    project.set_property('dbfs_large_file_threshold', 16 * 1024 * 1024)
+    project.set_property('dbfs_block_size', 1024 * 1024)
+    project.set_property('dbfs_block_retries', 3)
+    project.set_property('s3_multipart_chunksize', 8 * 1024 * 1024)
+    project.set_property('s3_max_concurrency', 10)
+    project.set_property('s3_use_threads', True)
+    project.set_property('jobs_list_page_size', 25)
+    project.set_property('job_diff_only', False)
+    project.set_property('job_deploy_workers', 1)
+    project.set_property('job_deploy_retries', 3)
 
 
 @task('post_init', description='Initializing some settings basing on passed init state.')
@@ -62,18 +136,179 @@ def post_init(project, logger):
     project.set_property('branch', project.get_property('branch', get_active_branch_name()))
 
 
+def _run_for_each_env(project, logger, task_name, action):
+    """
+    Runs the task action for the current env, or for every env of the "envs" property concurrently.
+    Every env is deployed in isolation, the task fails after all the envs are finished if any of them failed.
+    """
+    global _current_engine
+    _deploy_metrics.start_phase(task_name)
+    _current_engine = _get_deploy_engine(project, logger)
+    with _local_trees_lock:
+        # a shared scan lives for a task run, so the next task sees the local changes made in between
+        _local_trees.clear()
+    try:
+        _run_for_each_env_action(project, logger, task_name, action)
+    finally:
+        _current_engine = None
+        _write_deploy_report(project, task_name, logger)
+
+
+_current_engine = None
+_deploy_engines = {}
+_deploy_engines_lock = threading.Lock()
+
+
+def _get_deploy_engine(project, logger):
+    """
+    Returns the asyncio engine of the build if the "deploy_engine" property selects it, threads are used otherwise.
+    """
+    engine_name = str(project.get_property('deploy_engine', 'threads') or 'threads').lower()
+    if engine_name == 'threads':
+        return None
+    if engine_name != 'asyncio':
+        raise Exception(f'Unknown deploy engine "{engine_name}", use "threads" or "asyncio".')
+
+    concurrency = max(1, int(project.get_property('async_concurrency', 32) or 1))
+    with _deploy_engines_lock:
+        if concurrency not in _deploy_engines:
+            logger.info(f'Using the asyncio deploy engine with {concurrency} concurrent calls...')
+            _deploy_engines[concurrency] = _AsyncDeployEngine(concurrency)
+        return _deploy_engines[concurrency]
+
+
+class _AsyncDeployEngine:
+    """
+    A global thread pool of the build driven by a single event loop: the fan-out calls of all the tasks and envs
+    (uploads, deletes, listings, job resets and fetches, cluster status polls) share its workers instead of
+    a thread pool per call site. The databricks and boto3 clients are blocking, so every call occupies a worker
+    of the pool, which bounds the calls in flight by the pool size.
+    The single calls of a task (the job listing, the cluster starts and restarts, the library install requests,
+    the s3 archive upload) run on the calling thread and are not counted within the pool.
+    """
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency,
+                                                           thread_name_prefix='databricks-deploy'))
+        threading.Thread(target=self._loop.run_forever, name='databricks-deploy-loop', daemon=True).start()
+
+    async def _call(self, function, args):
+        return await self._loop.run_in_executor(None, function, *args)
+
+    def submit(self, function, *args):
+        """
+        Schedules the call on the event loop, the returned future can be used with concurrent.futures.wait.
+        """
+        return asyncio.run_coroutine_threadsafe(self._call(function, args), self._loop)
+
+
+def _call_in_engine(function, *args):
+    """
+    Runs a single remote call, e.g. a status poll, on a worker of the asyncio engine pool if the engine is used.
+    """
+    engine = _current_engine
+    return engine.submit(function, *args).result() if engine is not None else function(*args)
+
+
+def _run_for_each_env_action(project, logger, task_name, action):
+    envs = [env.lower() for env in _get_list_property(project, 'envs')]
+    if not envs:
+        return action(project, logger)
+
+    unknown_envs = [env for env in envs if env not in project.get_property('databricks_credentials')]
+    if unknown_envs:
+        raise Exception(f'No databricks credentials are specified for the envs: {", ".join(unknown_envs)}.')
+
+    def deploy_env(env):
+        start_time = time.time()
+        try:
+            action(_EnvProject(project, env), _PrefixedLogger(logger, env.upper()))
+            return env, 'SUCCEEDED', time.time() - start_time, ''
+        except Exception as e:
+            logger.error(f'[{env.upper()}] The {task_name} task has failed: {e}')
+            return env, 'FAILED', time.time() - start_time, str(e)
+
+    logger.info(f'\nRunning the {task_name} task for the envs: {", ".join(env.upper() for env in envs)}...\n')
+    with ThreadPoolExecutor(max_workers=len(envs)) as executor:
+        env_results = list(executor.map(deploy_env, envs))
+
+    logger.info(f'\nThe {task_name} task report:')
+    for env, status, duration, error in env_results:
+        logger.info(f'  {env.upper():<10} {status:<10} {duration:8.1f}s {error}'.rstrip())
+
+    failed_envs = [env for env, status, _, _ in env_results if status == 'FAILED']
+    if failed_envs:
+        raise Exception(f'The {task_name} task has failed for the envs: {", ".join(failed_envs)}.')
+
+
+class _EnvProject:
+    """
+    A view of the project bound to a single env of a fan-out deployment.
+    """
+
+    def __init__(self, project, env):
+        self._project = project
+        self._env = env
+
+    def get_property(self, key, default_value=None):
+        if key == 'env':
+            return self._env
+        return self._project.get_property(key, default_value)
+
+    def __getattr__(self, name):
+        return getattr(self._project, name)
+
+
+class _PrefixedLogger:
+    """
+    Prefixes the messages with the env or cluster name, so the logs of concurrent deployments can be told apart.
+    """
+
+    def __init__(self, logger, name):
+        self._logger = logger
+        self._prefix = f'[{name}] '
+
+    def debug(self, message, *args):
+        self._logger.debug(self._prefix + message, *args)
+
+    def info(self, message, *args):
+        self._logger.info(self._prefix + message, *args)
+
+    def warn(self, message, *args):
+        self._logger.warn(self._prefix + message, *args)
+
+    def error(self, message, *args):
+        self._logger.error(self._prefix + message, *args)
+
+
 @task('export_workspace', description='Uploading local files to a databricks workspace.')
 @depends('post_init')
 def export_workspace(project, logger):
+    _run_for_each_env(project, logger, 'export_workspace', _export_workspace)
+
+
+def _export_workspace(project, logger):
     env = project.get_property('env')
     logger.info(f'\nExporting the workspace to {env.upper()}...\n')
 
     remote_workspace_path = _build_remote_workspace_path(project)
     project_workspace_path = project.get_property('project_workspace_path')
 
-    workspace_client = WorkspaceApi(_get_databricks_client(project.get_property('databricks_credentials').get(env)))
-    workspace_client.mkdirs(workspace_path=remote_workspace_path)
-    _upload_workspace_files(workspace_client, project_workspace_path, remote_workspace_path, logger)
+    workspace_client = WorkspaceApi(_get_databricks_client(project, env))
+    # an archive is imported into a new directory only, so the bulk import creates the directory itself
+    if not _get_bool_property(project, 'workspace_bulk_import'):
+        workspace_client.mkdirs(workspace_path=remote_workspace_path)
+    journal = _get_checkpoint_journal(project, logger)
+    _upload_workspace_files(workspace_client, project_workspace_path, remote_workspace_path, logger,
+                            project.get_property('workspace_upload_workers', 1),
+                            _open_sync_manifest(project, remote_workspace_path, logger),
+                            _get_bool_property(project, 'delete_removed_files'),
+                            _get_bool_property(project, 'workspace_bulk_import'),
+                            project.get_property('workspace_archive_max_size'),
+                            _get_tree_scanner(project),
+                            journal)
 
     # handling configuration file depending on env
     enable_env_sensitive_workspace_properties = project.get_property('enable_env_sensitive_workspace_properties')
@@ -84,7 +319,8 @@ def export_workspace(project, logger):
             project_workspace_path + env_config_workspace_path.format(env=env))
         full_remote_config_path = '/'.join([remote_workspace_path, env_config_name])
         logger.info(f'Exporting the config to {full_remote_config_path}...')
-        _upload_workspace_file(workspace_client, full_project_config_path, full_remote_config_path, logger)
+        _upload_workspace_file(workspace_client, full_project_config_path, full_remote_config_path, logger,
+                               journal=journal)
 
     logger.info('\nThe workspace has been exported.\n')
 
@@ -102,45 +338,476 @@ def _build_remote_workspace_path(project):
     return remote_workspace_path
 
 
-def _upload_workspace_files(client, project_workspace_path, remote_workspace_path, logger):
+def _upload_workspace_files(client, project_workspace_path, remote_workspace_path, logger, workers=1,
+                            manifest=None, delete_removed_files=False, bulk_import=False, archive_max_size=None,
+                            scanner=None, journal=None):
     print(f'Scanning scripts folder: {project_workspace_path}...')
-    with os.scandir(project_workspace_path) as entries:
-        for entry in entries:
-            project_path = entry.path
-            remote_path = '/'.join([remote_workspace_path, os.path.splitext(entry.name)[0]])
-            if entry.is_dir():
-                client.mkdirs(workspace_path=remote_path)
-                _upload_workspace_files(client, project_path, remote_path, logger)
-            else:
-                _upload_workspace_file(client, project_path, remote_path, logger)
+    local_remote_paths = set()
+    entries = (scanner or _TreeScanner()).scan(project_workspace_path, remote_workspace_path, strip_extensions=True,
+                                               manifest=manifest, local_remote_paths=local_remote_paths)
+
+    # an archive replaces the remote directory, so it's imported only when the whole tree is uploaded
+    if bulk_import:
+        entries = list(entries)
+        files = [(entry.local_path, entry.remote_path) for entry in entries if not entry.is_directory]
+        resumed = journal is not None and journal.has_completed(f'workspace:{remote_workspace_path}/')
+        if files and len(files) == len(local_remote_paths) and not resumed:
+            files = _import_workspace_archive(client, files, remote_workspace_path, logger, archive_max_size,
+                                              manifest, journal)
+            # the directories of notebooks are created by the archive, the rest is needed by the remaining files
+            directories = sorted({remote_path.rsplit('/', 1)[0] for _, remote_path in files} - {remote_workspace_path})
+            entries = [_LocalEntry(None, directory, is_directory=True) for directory in directories]
+            entries.extend(_LocalEntry(local_path, remote_path) for local_path, remote_path in files)
+        else:
+            client.mkdirs(workspace_path=remote_workspace_path)
+
+    # a directory precedes its content in the stream, files wait for their parent directory to be created
+    directories = _DirectoryBarrier()
+
+    def upload_entry(entry):
+        if entry.is_directory:
+            with directories.creating(entry.remote_path):
+                _run_journaled(journal, f'workspace:{entry.remote_path}/', None,
+                               lambda: client.mkdirs(workspace_path=entry.remote_path), logger)
+        else:
+            directories.wait(entry.remote_path.rsplit('/', 1)[0])
+            _upload_workspace_file(client, entry.local_path, entry.remote_path, logger, manifest, journal)
+
+    try:
+        _run_concurrently(upload_entry, directories.register(entries), workers, 'upload', logger)
+
+        if manifest is not None and delete_removed_files:
+            removed_paths = manifest.removed_remote_paths(local_remote_paths)
+            logger.info(f'Found {len(removed_paths)} removed workspace files.')
+            _run_concurrently(lambda remote_path: _delete_remote_file(
+                lambda: client.delete(workspace_path=remote_path, is_recursive=False), remote_path, manifest, logger),
+                removed_paths, workers, 'delete the file', logger)
+    finally:
+        if manifest is not None:
+            manifest.save()
     print(f'\nAll the workspace files have been uploaded into {remote_workspace_path}.\n')
 
 
-def _upload_workspace_file(client, from_path, to_path, logger):
-    language = 'PYTHON' if from_path.endswith('.py') else 'SCALA' if from_path.endswith('.scala ') else 'R' if from_path.endswith('.r') else 'SQL'
-    client.import_workspace(
+def _get_tree_scanner(project):
+    # the envs of a fan-out deployment share a single scan of every local tree
+    return _TreeScanner(_get_list_property(project, 'upload_include_patterns'),
+                        _get_list_property(project, 'upload_exclude_patterns'),
+                        project.get_property('scan_prefetch_size', 1000),
+                        shared=len(_get_list_property(project, 'envs')) > 1)
+
+
+class _LocalEntry:
+    """
+    A file or a directory of a local tree with its remote path.
+    """
+    __slots__ = ('local_path', 'remote_path', 'is_directory', 'is_leaf')
+
+    def __init__(self, local_path, remote_path, is_directory=False, is_leaf=False):
+        self.local_path = local_path
+        self.remote_path = remote_path
+        self.is_directory = is_directory
+        self.is_leaf = is_leaf
+
+    def __str__(self):
+        return self.remote_path if self.is_directory else self.local_path
+
+
+class _TreeScanner:
+    """
+    Walks local trees lazily, a directory always precedes its content.
+    Entries matching the exclude patterns by name or relative path are skipped with their content,
+    files not matching the include patterns are skipped. The walk runs ahead of the consumer in a separate thread
+    through a bounded queue, so uploads start before the scan is finished and the memory usage stays bounded.
+    A shared scanner walks every tree once per task run and replays the walk to all the envs of a fan-out deployment.
+    """
+
+    def __init__(self, include_patterns=None, exclude_patterns=None, prefetch_size=1000, shared=False):
+        self.include_patterns = list(include_patterns or [])
+        self.exclude_patterns = list(exclude_patterns or [])
+        self.prefetch_size = max(1, int(prefetch_size or 1))
+        self.shared = shared
+
+    def scan(self, project_path, remote_path, strip_extensions=False, manifest=None, local_remote_paths=None):
+        """
+        Yields the entries of a local tree. If a manifest is given, only new directories and changed files are yielded,
+        the remote paths of all the scanned files are collected into local_remote_paths.
+        """
+        if self.shared:
+            entries = (_LocalEntry(entry.local_path, remote_path + entry.remote_path, entry.is_directory, entry.is_leaf)
+                       for entry in self._shared_walk(project_path, strip_extensions))
+        else:
+            entries = self._walk(project_path, remote_path, strip_extensions)
+        if manifest is not None or local_remote_paths is not None:
+            entries = _changed_entries(entries, manifest, local_remote_paths)
+        return _prefetch(entries, self.prefetch_size)
+
+    def _walk(self, project_path, remote_path, strip_extensions):
+        def to_remote_name(name):
+            return os.path.splitext(name)[0] if strip_extensions else name
+
+        pending = [(project_path, '', remote_path)]
+        while pending:
+            directory_path, relative_path, directory_remote_path = pending.pop()
+            subdirectories, files = [], []
+            with os.scandir(directory_path) as entries:
+                for entry in sorted(entries, key=lambda entry: entry.name):
+                    relative_entry_path = f'{relative_path}/{entry.name}' if relative_path else entry.name
+                    if self._is_excluded(entry.name, relative_entry_path):
+                        continue
+                    remote_entry_path = f'{directory_remote_path}/{to_remote_name(entry.name)}'
+                    if entry.is_dir():
+                        subdirectories.append((entry.path, relative_entry_path, remote_entry_path))
+                    elif self._is_included(entry.name, relative_entry_path):
+                        files.append(_LocalEntry(entry.path, remote_entry_path))
+
+            if relative_path:
+                yield _LocalEntry(directory_path, directory_remote_path, is_directory=True, is_leaf=not subdirectories)
+            yield from files
+            # the stack is filled in reverse, so the directories are walked in order
+            pending.extend(reversed(subdirectories))
+
+    def _shared_walk(self, project_path, strip_extensions):
+        # the remote paths of a shared walk are relative to the remote root of a consumer
+        cache_key = (os.path.abspath(project_path), strip_extensions, tuple(self.include_patterns),
+                     tuple(self.exclude_patterns))
+        with _local_trees_lock:
+            if cache_key not in _local_trees:
+                _local_trees[cache_key] = _SharedWalk(self._walk(project_path, '', strip_extensions))
+            return _local_trees[cache_key]
+
+    def _is_excluded(self, name, relative_path):
+        return any(fnmatch(name, pattern) or fnmatch(relative_path, pattern) for pattern in self.exclude_patterns)
+
+    def _is_included(self, name, relative_path):
+        return not self.include_patterns or any(
+            fnmatch(name, pattern) or fnmatch(relative_path, pattern) for pattern in self.include_patterns)
+
+
+_local_trees = {}
+_local_trees_lock = threading.Lock()
+
+
+class _SharedWalk:
+    """
+    A walk of a local tree replayed to several consumers. The tree is walked once in a separate thread,
+    the consumers follow the walk as it goes and get the same entries in the same order.
+    """
+
+    def __init__(self, walk):
+        self._entries = []
+        self._done = False
+        self._error = None
+        self._condition = threading.Condition()
+        threading.Thread(target=self._run, args=(walk,), daemon=True).start()
+
+    def _run(self, walk):
+        try:
+            for entry in walk:
+                with self._condition:
+                    self._entries.append(entry)
+                    self._condition.notify_all()
+        except Exception as e:
+            self._error = e
+        finally:
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self._entries) and not self._done:
+                    self._condition.wait()
+                entries = self._entries[index:]
+                if not entries:
+                    if self._error is not None:
+                        raise self._error
+                    return
+            index += len(entries)
+            yield from entries
+
+
+def _changed_entries(entries, manifest, local_remote_paths):
+    for entry in entries:
+        if entry.is_directory:
+            if manifest is None or manifest.new_directories([entry.remote_path]):
+                yield entry
+        else:
+            if local_remote_paths is not None:
+                local_remote_paths.add(entry.remote_path)
+            if manifest is None or manifest.changed_files([(entry.local_path, entry.remote_path)]):
+                yield entry
+
+
+_end_of_stream = object()
+
+
+def _prefetch(items, size):
+    """
+    Runs the generator in a separate thread ahead of the consumer, up to size items are kept in a bounded queue.
+    A failure of the generator is raised to the consumer after the items produced before it.
+    """
+    buffer = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((_end_of_stream, None))
+        except Exception as e:
+            put((_end_of_stream, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _end_of_stream:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+class _DirectoryBarrier:
+    """
+    Lets files of a streamed tree wait for their parent directories created concurrently.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._created = {}
+        self._failed = set()
+
+    def register(self, entries):
+        for entry in entries:
+            if entry.is_directory:
+                with self._lock:
+                    self._created[entry.remote_path] = threading.Event()
+            yield entry
+
+    @contextmanager
+    def creating(self, remote_path):
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self._failed.add(remote_path)
+            raise
+        finally:
+            self._created[remote_path].set()
+
+    def wait(self, remote_path):
+        with self._lock:
+            created = self._created.get(remote_path)
+        # directories which aren't created by the upload already exist
+        if created is not None:
+            created.wait()
+            if remote_path in self._failed:
+                raise Exception(f'The parent directory {remote_path} has not been created.')
+
+
+def _delete_remote_file(delete, remote_path, manifest, logger):
+    try:
+        delete()
+    except Exception as e:
+        # a file deleted by other means, e.g. by the prune tasks, is forgotten as well
+        if not _is_not_found(e):
+            raise
+    manifest.forget(remote_path)
+    logger.info(f'The removed file has been deleted: {remote_path}.')
+
+
+def _run_concurrently(action, items, workers, description, logger):
+    """
+    Applies the action to every item using a bounded pool of threads.
+    Items are consumed lazily and at most two items per worker are queued, so generators are never materialized.
+    Every failure is reported separately, the call fails once all the items are processed.
+    """
+    engine = _current_engine
+    # the asyncio engine replaces the per call site workers with the concurrency budget of the build
+    workers = engine.concurrency if engine is not None else max(1, int(workers or 1))
+    futures = {}
+    failed_items = []
+    item_count = 0
+
+    def run_action(item, submitted_at):
+        _deploy_metrics.record_queue_wait(time.monotonic() - submitted_at)
+        return action(item)
+
+    def collect(done_futures):
+        for future in done_futures:
+            item = futures.pop(future)
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f'Failed to {description} {item}: {e}')
+                failed_items.append(item)
+
+    with nullcontext(engine) if engine is not None else ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            if len(futures) >= 2 * workers:
+                collect(wait(futures, return_when=FIRST_COMPLETED).done)
+            futures[executor.submit(run_action, item, time.monotonic())] = item
+            item_count += 1
+        collect(as_completed(list(futures)))
+
+    if failed_items:
+        raise Exception(f'Failed to {description}: {len(failed_items)} of {item_count} item(s) failed...')
+    return item_count
+
+
+_workspace_languages = {'.py': 'PYTHON', '.scala': 'SCALA', '.r': 'R', '.sql': 'SQL'}
+_notebook_headers = {'PYTHON': b'# Databricks notebook source', 'SCALA': b'// Databricks notebook source',
+                     'R': b'# Databricks notebook source', 'SQL': b'-- Databricks notebook source'}
+
+
+def _get_workspace_language(path):
+    return _workspace_languages.get(os.path.splitext(path)[1].lower(), 'SQL')
+
+
+def _is_exported_notebook(path):
+    """
+    Checks whether the file is a notebook in the Databricks source format, which is recognized inside an archive.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in _workspace_languages:
+        return False
+    header = _notebook_headers[_workspace_languages[extension]]
+    with open(path, 'rb') as file:
+        return file.read(len(header)) == header
+
+
+def _import_workspace_archive(client, files, remote_workspace_path, logger, archive_max_size=None, manifest=None,
+                              journal=None):
+    """
+    Imports the notebooks with a single request of a zipped directory in the source format.
+    An archive can't overwrite a directory, so it's imported only if the remote directory doesn't exist yet,
+    the remote directory is created otherwise.
+    Returns the files left for the per-file import: the ones an archive can't hold (files without a notebook header
+    or with an unknown extension), or all of them if the directory exists, the archive is too large
+    or its import has failed.
+    """
+    notebooks = [file for file in files if _is_exported_notebook(file[0])]
+    if not notebooks:
+        client.mkdirs(workspace_path=remote_workspace_path)
+        return files
+
+    if _workspace_path_exists(client, remote_workspace_path):
+        logger.info(f'The directory {remote_workspace_path} exists and an archive can\'t overwrite it, '
+                    f'the files are imported one by one.')
+        return files
+
+    root_name = remote_workspace_path.rstrip('/').rsplit('/', 1)[-1]
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for project_path, remote_path in notebooks:
+            relative_path = remote_path[len(remote_workspace_path):].lstrip('/')
+            extension = os.path.splitext(project_path)[1].lower()
+            zip_file.write(project_path, f'{root_name}/{relative_path}{extension}')
+
+    # the request carries the archive as base64 text, so the limit applies to the encoded size
+    content = b64encode(archive.getvalue()).decode()
+    archive_size = len(content)
+    if archive_max_size and archive_size > int(archive_max_size):
+        logger.warn(f'The encoded workspace archive of {archive_size} bytes exceeds {archive_max_size} bytes, '
+                    f'the files are imported one by one.')
+        client.mkdirs(workspace_path=remote_workspace_path)
+        return files
+
+    logger.info(f'Importing {len(notebooks)} notebooks as an archive of {archive.tell()} bytes...')
+    client.mkdirs(workspace_path=remote_workspace_path.rstrip('/').rsplit('/', 1)[0] or '/')
+    try:
+        client.client.import_workspace(remote_workspace_path, 'SOURCE', None, content, False)
+    except Exception as e:
+        logger.warn(f'The workspace archive import has failed, the files are imported one by one: {e}')
+        client.mkdirs(workspace_path=remote_workspace_path)
+        return files
+
+    for project_path, remote_path in notebooks:
+        if manifest is not None:
+            manifest.mark_uploaded(project_path, remote_path)
+        if journal is not None:
+            journal.complete(f'workspace:{remote_path}', _get_file_digest(project_path))
+    if journal is not None:
+        for directory in sorted({directory for _, remote_path in notebooks for directory in
+                                 _parent_directories(remote_path) if directory.startswith(remote_workspace_path + '/')}):
+            journal.complete(f'workspace:{directory}/')
+    logger.info(f'The archive has been imported into {remote_workspace_path}.')
+    imported_paths = {remote_path for _, remote_path in notebooks}
+    return [file for file in files if file[1] not in imported_paths]
+
+
+def _workspace_path_exists(client, remote_path):
+    try:
+        client.client.get_status(remote_path)
+        return True
+    except Exception as e:
+        if _is_not_found(e):
+            return False
+        raise
+
+
+def _upload_workspace_file(client, from_path, to_path, logger, manifest=None, journal=None):
+    language = _get_workspace_language(from_path)
+    uploaded = _run_journaled(journal, f'workspace:{to_path}', from_path, lambda: client.import_workspace(
         source_path=from_path,
         target_path=to_path,
         fmt='SOURCE',
         language=language,
         is_overwrite=True,
         headers=None
-    )
-    logger.info(f'The file has been uploaded into {to_path}.')
+    ), logger)
+    if manifest is not None:
+        manifest.mark_uploaded(from_path, to_path)
+    if uploaded:
+        logger.info(f'The file has been uploaded into {to_path}.')
 
 
-def _upload_files_to_dbfs(client, project_resources_path, dbfs_resources_path, logger):
+def _upload_files_to_dbfs(client, project_resources_path, dbfs_resources_path, logger, manifest=None,
+                          delete_removed_files=False, workers=1, large_file_threshold=None,
+                          block_size=1024 * 1024, block_retries=3, scanner=None, journal=None):
     logger.info(f'Creating remote directories: {dbfs_resources_path}...')
     client.mkdirs(DbfsPath(dbfs_resources_path))
     logger.info(f'Scanning resources folder: {project_resources_path}...')
-    with os.scandir(project_resources_path) as entries:
-        for entry in entries:
-            project_path = entry.path
-            remote_path = '/'.join([dbfs_resources_path, entry.name])
-            if entry.is_dir():
-                client.mkdirs(DbfsPath(remote_path))
-                _upload_files_to_dbfs(client, project_path, remote_path, logger)
-            else:
+    local_remote_paths = set()
+    entries = (scanner or _TreeScanner()).scan(project_resources_path, dbfs_resources_path, manifest=manifest,
+                                               local_remote_paths=local_remote_paths)
+
+    def upload_entry(entry):
+        if entry.is_directory:
+            _run_journaled(journal, f'resource:{entry.remote_path}/', None,
+                           lambda: client.mkdirs(DbfsPath(entry.remote_path)), logger)
+            return
+
+        project_path, remote_path = entry.local_path, entry.remote_path
+        if _run_journaled(journal, f'resource:{remote_path}', project_path,
+                          lambda: upload_file(project_path, remote_path), logger):
+            logger.info(f'The {project_path} has bean uploaded.')
+        if manifest is not None:
+            manifest.mark_uploaded(project_path, remote_path)
+
+    def upload_file(project_path, remote_path):
+        file_size = os.path.getsize(project_path)
+        if large_file_threshold and file_size >= int(large_file_threshold):
+            with _deploy_metrics.measure('dbfs stream', remote_path, file_size, composite=True):
+                _stream_file_to_dbfs(client.client, project_path, remote_path, int(block_size), int(block_retries),
+                                     logger)
+        else:
+            with _deploy_metrics.measure('dbfs cp', remote_path, file_size, composite=True):
                 client.cp(
                     recursive=True,
                     overwrite=True,
@@ -148,22 +815,535 @@ def _upload_files_to_dbfs(client, project_resources_path, dbfs_resources_path, l
                     dst=remote_path,
                     headers=None
                 )
-                logger.info(f'The {project_path} has bean uploaded.')
+
+    try:
+        # dbfs creates parent directories implicitly, so only the deepest ones are requested
+        _run_concurrently(upload_entry, (entry for entry in entries if not entry.is_directory or entry.is_leaf),
+                          workers, 'upload', logger)
+
+        if manifest is not None and delete_removed_files:
+            removed_paths = manifest.removed_remote_paths(local_remote_paths)
+            logger.info(f'Found {len(removed_paths)} removed resource files.')
+            _run_concurrently(lambda remote_path: _delete_remote_file(
+                lambda: client.delete(DbfsPath(remote_path), recursive=False), remote_path, manifest, logger),
+                removed_paths, workers, 'delete the file', logger)
+    finally:
+        if manifest is not None:
+            manifest.save()
     logger.info(f'\nAll the resource files have been uploaded into {dbfs_resources_path}.\n')
 
 
+_DBFS_MAX_BLOCK_SIZE = 1024 * 1024
+
+
+def _get_dbfs_block_size(project):
+    # larger blocks are rejected by the add-block api, so every block would fail and burn all the retries
+    block_size = int(project.get_property('dbfs_block_size', _DBFS_MAX_BLOCK_SIZE) or _DBFS_MAX_BLOCK_SIZE)
+    if not 0 < block_size <= _DBFS_MAX_BLOCK_SIZE:
+        raise Exception(f'The "dbfs_block_size" property must be between 1 and {_DBFS_MAX_BLOCK_SIZE} bytes, '
+                        f'got {block_size}.')
+    return block_size
+
+
+def _stream_file_to_dbfs(dbfs_service, project_path, remote_path, block_size, block_retries, logger, file_retries=1):
+    """
+    Uploads a file using the dbfs create/add-block/close handle API.
+    The file is memory-mapped and sent in fixed-size blocks, so the memory usage doesn't depend on the file size.
+    A failed block is retried with a backoff instead of restarting the whole file.
+    The add-block call has no offset, so a retried block which has been applied already duplicates the data.
+    The size of the closed remote file is checked, and the whole file is streamed again if it differs.
+    """
+    dbfs_path = DbfsPath(remote_path).absolute_path
+    file_size = os.path.getsize(project_path)
+    for attempt in range(int(file_retries) + 1):
+        logger.info(f'Streaming the large file {project_path} into {remote_path}...')
+        _stream_file_blocks(dbfs_service, project_path, dbfs_path, block_size, block_retries, logger)
+        remote_size = dbfs_service.get_status(dbfs_path).get('file_size')
+        if remote_size == file_size:
+            return
+        logger.warn(f'The streamed file {remote_path} has {remote_size} bytes instead of {file_size}.')
+
+    raise Exception(f'Failed to stream the file {project_path} into {remote_path}: '
+                    f'the remote file size doesn\'t match the local one.')
+
+
+def _stream_file_blocks(dbfs_service, project_path, dbfs_path, block_size, block_retries, logger):
+    handle = dbfs_service.create(dbfs_path, overwrite=True)['handle']
+    try:
+        with open(project_path, 'rb') as file:
+            file_size = os.fstat(file.fileno()).st_size
+            if file_size:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                    for offset in range(0, file_size, block_size):
+                        block = b64encode(content[offset:offset + block_size]).decode()
+                        _call_with_retries(lambda: dbfs_service.add_block(handle, block), block_retries,
+                                           f'add the block at {offset} of {dbfs_path}', logger)
+    except Exception:
+        # the handle is released, so the failed upload doesn't leave an open stream behind
+        try:
+            dbfs_service.close(handle)
+        except Exception as e:
+            logger.warn(f'Failed to close the stream of {dbfs_path}: {e}')
+        raise
+    dbfs_service.close(handle)
+
+
+def _call_with_retries(call, retries, description, logger, backoff=1.0, is_retryable=None):
+    """
+    Calls the function retrying failures with an exponential backoff.
+    The Retry-After header of a failed http response is respected if present.
+    """
+    for attempt in range(int(retries) + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt >= int(retries) or (is_retryable is not None and not is_retryable(e)):
+                raise
+            delay = _get_retry_after(e) or backoff * 2 ** attempt
+            logger.warn(f'Failed to {description}: {e}. Retrying in {delay} seconds...')
+            time.sleep(delay)
+
+
+def _get_retry_after(error):
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _open_sync_manifest(project, remote_path, logger):
+    """
+    Returns the manifest of files synchronized with the remote path if the incremental sync is enabled.
+    Manifests are stored per env, branch and remote path. The "force_full" flag drops the stored state.
+    """
+    if not _get_bool_property(project, 'incremental_sync'):
+        return None
+
+    env = project.get_property('env')
+    branch = project.get_property('branch')
+    manifest_key = '/'.join([str(env), str(branch), remote_path])
+    manifest_name = hashlib.sha256(manifest_key.encode('utf-8')).hexdigest()[:32] + '.json'
+    manifest_path = os.path.join(project.expand_path(project.get_property('sync_manifest_path')), manifest_name)
+
+    force_full = _get_bool_property(project, 'force_full')
+    logger.info(f'Using the sync manifest {manifest_path}{" (forced full sync)" if force_full else ""}...')
+    return _SyncManifest(manifest_path, manifest_key, force_full, remote_path)
+
+
+class _SyncManifest:
+    """
+    The local state of files uploaded to a remote path: sha256, size and mtime of every local file.
+    A file is changed if its content is, hashes are recalculated only for files with a changed size or mtime.
+    """
+
+    def __init__(self, path, key, force_full=False, remote_path=None):
+        self.path = path
+        self.key = key
+        self.remote_path = remote_path
+        self._lock = threading.Lock()
+        self._fingerprints = {}
+        self.files = {}
+        self.directories = set()
+        if not force_full and os.path.exists(path):
+            with open(path, 'r') as file:
+                state = json.load(file)
+            self.files = state.get('files', {})
+            self.directories = set(state.get('directories', []))
+            self.remote_path = self.remote_path or state.get('remote_path')
+        self._records_by_local_path = {record.get('local_path'): record for record in self.files.values()}
+
+    def changed_files(self, files):
+        changed_files = []
+        for local_path, remote_path in files:
+            fingerprint = self._fingerprint(local_path)
+            record = self.files.get(remote_path)
+            if not record or (record.get('sha256'), record.get('size')) != (fingerprint['sha256'], fingerprint['size']):
+                changed_files.append((local_path, remote_path))
+            elif record.get('mtime') != fingerprint['mtime']:
+                # the content is the same, e.g. after a checkout, the new mtime spares hashing it by the next build
+                with self._lock:
+                    record['mtime'] = fingerprint['mtime']
+        return changed_files
+
+    def new_directories(self, directories):
+        return [directory for directory in directories if directory not in self.directories]
+
+    def removed_remote_paths(self, local_remote_paths):
+        return [remote_path for remote_path in self.files if remote_path not in local_remote_paths]
+
+    def mark_uploaded(self, local_path, remote_path):
+        fingerprint = self._fingerprint(local_path)
+        with self._lock:
+            self.files[remote_path] = dict(fingerprint, local_path=local_path)
+            self.directories.update(_parent_directories(remote_path))
+
+    def forget(self, remote_path):
+        with self._lock:
+            self.files.pop(remote_path, None)
+
+    def forget_tree(self, remote_path):
+        """
+        Drops the files and directories under the remote path, e.g. a pruned directory. Returns True if any were known.
+        """
+        prefix = _get_sync_path(remote_path) + '/'
+        with self._lock:
+            removed_files = [path for path in self.files if f'{_get_sync_path(path)}/'.startswith(prefix)]
+            for path in removed_files:
+                del self.files[path]
+            kept_directories = {path for path in self.directories if not f'{_get_sync_path(path)}/'.startswith(prefix)}
+            removed = bool(removed_files) or len(kept_directories) < len(self.directories)
+            self.directories = kept_directories
+        return removed
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock:
+            state = {'key': self.key, 'remote_path': self.remote_path, 'files': self.files,
+                     'directories': sorted(self.directories)}
+        with open(self.path, 'w') as file:
+            json.dump(state, file, indent=2, sort_keys=True)
+
+    def _fingerprint(self, local_path):
+        if local_path not in self._fingerprints:
+            stat = os.stat(local_path)
+            size, mtime = stat.st_size, stat.st_mtime_ns
+            record = self._records_by_local_path.get(local_path)
+            if record and record.get('size') == size and record.get('mtime') == mtime:
+                sha256 = record['sha256']
+            else:
+                sha256 = _cached_file_sha256(local_path, size, mtime)
+            self._fingerprints[local_path] = {'sha256': sha256, 'size': size, 'mtime': mtime}
+
+        return self._fingerprints[local_path]
+
+
+def _get_sync_path(remote_path):
+    # the dbfs paths are listed without the scheme the manifests of the resources are keyed with
+    return re.sub(r'^dbfs:', '', remote_path).rstrip('/')
+
+
+def _forget_pruned_paths(project, pruned_paths, is_dbfs, logger):
+    """
+    Drops the pruned remote paths from the sync manifests of the env, so the files restored locally are uploaded
+    again by the incremental sync. A manifest of a pruned directory, e.g. of a deleted branch, is removed.
+    """
+    manifests_path = project.expand_path(project.get_property('sync_manifest_path'))
+    if not pruned_paths or not os.path.isdir(manifests_path):
+        return
+
+    env_prefix = f'{project.get_property("env")}/'
+    for manifest_name in sorted(os.listdir(manifests_path)):
+        manifest_path = os.path.join(manifests_path, manifest_name)
+        if not manifest_name.endswith('.json'):
+            continue
+        try:
+            with open(manifest_path, 'r') as file:
+                state = json.load(file)
+        except ValueError:
+            continue
+        manifest_remote_path = state.get('remote_path')
+        if not manifest_remote_path or not str(state.get('key', '')).startswith(env_prefix) \
+                or manifest_remote_path.startswith('dbfs:') != is_dbfs:
+            continue
+
+        manifest = _SyncManifest(manifest_path, state['key'])
+        if any(f'{_get_sync_path(manifest_remote_path)}/'.startswith(_get_sync_path(path) + '/') for path in pruned_paths):
+            os.remove(manifest_path)
+            logger.info(f'The sync manifest of the pruned {manifest_remote_path} has been removed.')
+        elif any([manifest.forget_tree(path) for path in pruned_paths]):
+            manifest.save()
+
+
+def _parent_directories(remote_path):
+    parts = remote_path.split('/')[:-1]
+    return ['/'.join(parts[:i]) for i in range(2, len(parts) + 1)]
+
+
+_file_hashes = {}
+
+
+def _cached_file_sha256(local_path, size, mtime):
+    # the hashes are shared by the manifests of all the environments within a build
+    cache_key = (os.path.abspath(local_path), size, mtime)
+    if cache_key not in _file_hashes:
+        _file_hashes[cache_key] = _file_sha256(local_path)
+
+    return _file_hashes[cache_key]
+
+
+def _file_sha256(local_path):
+    sha256 = hashlib.sha256()
+    with open(local_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+_state_caches = {}
+_state_caches_lock = threading.Lock()
+
+
+def _get_state_cache(project):
+    """
+    Returns the state cache shared by all the envs and tasks of the build if the "state_cache" flag is set.
+    """
+    if not _get_bool_property(project, 'state_cache'):
+        return None
+
+    path = project.expand_path(project.get_property('state_cache_path'))
+    with _state_caches_lock:
+        if path not in _state_caches:
+            _state_caches[path] = _StateCache(path, project.get_property('state_cache_ttl', 60 * 60))
+        return _state_caches[path]
+
+
+class _StateCache:
+    """
+    The local state of remote lookups kept between builds: cluster and job listings.
+    Entries expire after the ttl. The cache is written after every change, so it survives failed builds.
+    """
+
+    def __init__(self, path, ttl, clock=time.time):
+        self.path = path
+        self.ttl = float(ttl or 0)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    self._entries = json.load(file).get('entries', {})
+            except ValueError:
+                # a broken cache is dropped, it's going to be filled again
+                self._entries = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or self._clock() - entry['updated_at'] > self.ttl:
+            return None
+        return entry['value']
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = {'value': value, 'updated_at': self._clock()}
+            self._save()
+
+    def invalidate(self, key_prefix):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(key_prefix)]:
+                del self._entries[key]
+            self._save()
+
+    @contextmanager
+    def invalidating(self, key_prefix):
+        """
+        Drops the entries if the wrapped block fails, so stale ids aren't used by the next build.
+        """
+        try:
+            yield
+        except Exception:
+            self.invalidate(key_prefix)
+            raise
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump({'entries': self._entries}, file, indent=2, sort_keys=True)
+        os.replace(temporary_path, self.path)
+
+
+class _CachedLookup:
+    """
+    Resolves values from a cached remote listing. The listing is fetched again if the cached one is expired
+    or misses any of the values, so a stale listing never fails the lookup.
+    An id resolved from the cached listing may belong to a deleted object, e.g. a recreated job,
+    so the listing is fetched once again if a call with the cached values finds nothing.
+    """
+
+    def __init__(self, state_cache, key, fetch, resolve):
+        self._state_cache = state_cache
+        self._key = key
+        self._fetch = fetch
+        self._resolve = resolve
+        self._lock = threading.Lock()
+        self._cached = False
+        listing = state_cache.get(key) if state_cache is not None else None
+        if listing is not None:
+            try:
+                self.values = resolve(listing)
+                self._cached = True
+                return
+            except Exception:
+                pass
+        self.values = self._refresh()
+
+    def call(self, action):
+        """
+        Runs the action with the resolved values, once again with the fetched listing
+        if the cached values pointed to a missing object.
+        """
+        values = self.values
+        try:
+            return action(values)
+        except Exception as e:
+            if not self._cached or not _is_not_found(e):
+                raise
+
+        with self._lock:
+            # the listing is fetched by the first failed call, the concurrent ones reuse it
+            if self._cached:
+                self.values = self._refresh()
+                self._cached = False
+        return action(self.values)
+
+    def _refresh(self):
+        listing = self._fetch()
+        if self._state_cache is not None:
+            self._state_cache.set(self._key, listing)
+        return self._resolve(listing)
+
+
+def _is_not_found(error):
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) == 404:
+        return True
+    try:
+        error_body = response.json()
+    except Exception:
+        return False
+    return error_body.get('error_code') == 'RESOURCE_DOES_NOT_EXIST' \
+        or error_body.get('error_code') == 'INVALID_PARAMETER_VALUE' and 'does not exist' in error_body.get('message', '')
+
+
+@contextmanager
+def _invalidating(state_cache, key_prefix):
+    if state_cache is None:
+        yield
+    else:
+        with state_cache.invalidating(key_prefix):
+            yield
+
+
+_checkpoint_journals = {}
+_checkpoint_journals_lock = threading.Lock()
+
+
+def _get_checkpoint_journal(project, logger):
+    """
+    Returns the journal of the deployment units completed for the env and branch if the "checkpoint_journal" flag is set.
+    The journal is shared by all the tasks of the build. It's started over by the first task,
+    unless the "resume" flag is set to skip the units completed by the previous builds.
+    """
+    if not _get_bool_property(project, 'checkpoint_journal', True):
+        return None
+
+    journal_key = '/'.join([str(project.get_property('env')), str(project.get_property('branch'))])
+    journal_name = hashlib.sha256(journal_key.encode('utf-8')).hexdigest()[:32] + '.jsonl'
+    path = os.path.join(project.expand_path(project.get_property('checkpoint_journal_path')), journal_name)
+    with _checkpoint_journals_lock:
+        if path not in _checkpoint_journals:
+            resume = _get_bool_property(project, 'resume')
+            _checkpoint_journals[path] = _CheckpointJournal(path, resume)
+            if resume:
+                logger.info(f'Resuming the deployment of {journal_key} from the journal {path} '
+                            f'with {_checkpoint_journals[path].completed_count} completed units...')
+        return _checkpoint_journals[path]
+
+
+class _CheckpointJournal:
+    """
+    The append-only log of the deployment units completed by a build: uploaded files with their size and mtime,
+    created directories, reset jobs with the sha256 of their settings and installed libraries.
+    A line is appended as soon as a unit is completed, so an interrupted build leaves the list of the work
+    which doesn't have to be repeated. Only the units of the previous builds are considered completed.
+    The file is opened for every line, so no handle is left open by the build.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._completed = {}
+        content = ''
+        if resume and os.path.exists(path):
+            with open(path, 'r') as file:
+                content = file.read()
+            for line in content.splitlines():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line of a killed build might be written partially
+                    continue
+                self._completed[record['unit']] = record['digest']
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a' if resume else 'w') as file:
+            if content and not content.endswith('\n'):
+                file.write('\n')
+
+    @property
+    def completed_count(self):
+        return len(self._completed)
+
+    def is_completed(self, unit, digest=''):
+        return unit in self._completed and self._completed[unit] == digest
+
+    def has_completed(self, unit_prefix):
+        return any(unit.startswith(unit_prefix) for unit in self._completed)
+
+    def complete(self, unit, digest=''):
+        line = json.dumps({'unit': unit, 'digest': digest, 'completed_at': time.time()})
+        with self._lock, open(self.path, 'a') as file:
+            file.write(line + '\n')
+
+
+def _run_journaled(journal, unit, local_path, action, logger):
+    """
+    Runs the action of a deployment unit and appends the unit to the journal with the size and mtime of the local file.
+    The action is skipped if the unit has been completed by a previous build with the same file size and mtime.
+    """
+    if journal is None:
+        action()
+        return True
+
+    digest = _get_file_digest(local_path) if local_path else ''
+    if journal.is_completed(unit, digest):
+        logger.info(f'The {unit} has been completed by a previous build. Skipping...')
+        return False
+    action()
+    journal.complete(unit, digest)
+    return True
+
+
+def _get_file_digest(local_path):
+    # a single stat per file, hashing every uploaded file would cost more than the upload of small files
+    stat = os.stat(local_path)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def _get_settings_digest(settings):
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
 @task('install_library', description='Installing a build whl archive as a dependency into a Databricks cluster.')
 @depends('post_init')
 def install_library(project, logger):
     """
     This task should be run to upload the whl-archive to a cluster.
     """
+    _run_for_each_env(project, logger, 'install_library', _install_library)
+
+
+def _install_library(project, logger):
     logger.info('\nInstalling the library to a cluster...\n')
     if not project.name or project.name == '.':
         raise Exception('Specify the "name" attribute of the project in your build.py.')
 
-    cluster_name = project.get_property('remote_cluster_name')
-    if cluster_name is None:
+    cluster_names = _get_list_property(project, 'remote_cluster_name')
+    if not cluster_names:
         raise Exception('The "remote_cluster_name" property is not set...\n')
 
     library_s3_path = project.get_property('attachable_lib_s3_path')
@@ -176,105 +1356,432 @@ def install_library(project, logger):
 
     env = project.get_property('env')
     branch = project.get_property('branch')
-    db_client = _get_databricks_client(project.get_property('databricks_credentials').get(env))
+    db_client = _get_databricks_client(project, env)
     cluster_client = ClusterApi(db_client)
-    cluster_id = cluster_client.get_cluster_id_for_name(cluster_name)
+    library_remote_dir = library_remote_path.format(env=env, branch=branch).rstrip('/')
+
+    archive_path = _find_archive(project.expand_path('$dir_dist'), project.name, logger)
+    library_path = '/'.join([library_remote_dir, os.path.basename(archive_path)])
+    state_cache = _get_state_cache(project)
+    journal = _get_checkpoint_journal(project, logger)
+    clusters_cache_key = f'clusters/{project.get_property("databricks_credentials").get(env).get("host")}'
+    cluster_lookup = _resolve_clusters(cluster_client, cluster_names, state_cache, clusters_cache_key)
+    clusters = cluster_lookup.values
+
+    # the archive is uploaded once for all the clusters, the first cluster reaching the stage uploads it
+    upload_lock = threading.Lock()
+    uploaded_archives = []
+
+    def upload_archive():
+        with upload_lock:
+            if not uploaded_archives:
+                uploaded_archives.append(_upload_archive(library_s3_path.format(env=env, branch=branch),
+                                                         archive_path,
+                                                         project.get_property('clean_attachable_lib', False),
+                                                         project.get_property('use_aws_role'),
+                                                         logger,
+                                                         _get_s3_transfer_config(project)))
+            return uploaded_archives[0]
+
+    def install_to_cluster_id(cluster_name, cluster_id):
+        # the installation is recorded once the library is attached and the cluster is restarted if needed
+        unit, digest = f'library:{cluster_id}:{library_path}', _get_archive_sha256(archive_path)
+        if journal is not None and journal.is_completed(unit, digest):
+            logger.info(f'The library {library_path} has been installed to the cluster "{cluster_name}" '
+                        f'by a previous build. Skipping...')
+            return 'RESUMED'
+        status = _install_library_to_cluster(project, cluster_client, LibrariesApi(db_client), cluster_id,
+                                             library_path, library_s3_path.format(env=env, branch=branch),
+                                             archive_path, upload_archive,
+                                             _PrefixedLogger(logger, cluster_name) if len(clusters) > 1 else logger)
+        if journal is not None:
+            journal.complete(unit, digest)
+        return status
+
+    def install_to_cluster(cluster):
+        cluster_name, cluster_id = cluster
+        start_time = time.time()
+        try:
+            # a cached id of a recreated cluster is mapped to the id of the new cluster
+            status = cluster_lookup.call(
+                lambda resolved_clusters: install_to_cluster_id(
+                    cluster_name, _get_current_cluster_id(clusters, resolved_clusters, cluster_name, cluster_id)))
+            return cluster_name, cluster_id, status, time.time() - start_time, ''
+        except Exception as e:
+            logger.error(f'Failed to install the library to the cluster "{cluster_name}" ({cluster_id}): {e}')
+            return cluster_name, cluster_id, 'FAILED', time.time() - start_time, str(e)
+
+    with ThreadPoolExecutor(max_workers=len(clusters)) as executor:
+        cluster_results = list(executor.map(install_to_cluster, clusters))
+
+    if len(clusters) > 1:
+        logger.info('\nThe library installation report:')
+        for cluster_name, cluster_id, status, duration, error in cluster_results:
+            logger.info(f'  {cluster_name:<30} {cluster_id:<24} {status:<10} {duration:8.1f}s {error}'.rstrip())
+
+    failed_clusters = [f'{cluster_name} ({cluster_id})'
+                       for cluster_name, cluster_id, status, _, _ in cluster_results if status == 'FAILED']
+    if failed_clusters:
+        if state_cache is not None:
+            state_cache.invalidate(clusters_cache_key)
+        raise Exception(f'Failed to install the library to the clusters: {", ".join(failed_clusters)}.')
+
+
+def _resolve_clusters(cluster_client, cluster_names, state_cache=None, cache_key=None):
+    """
+    Resolves cluster names and glob patterns into (name, id) pairs with a single listing of the clusters.
+    A plain name must match exactly one cluster, a pattern must match at least one.
+    Returns the lookup holding the resolved pairs.
+    """
+    def list_clusters():
+        return [[cluster.get('cluster_name', ''), cluster['cluster_id']]
+                for cluster in cluster_client.list_clusters().get('clusters', [])]
 
-    archive_name = _upload_archive(library_s3_path.format(env=env, branch=branch),
-                                   project.expand_path('$dir_dist'),
-                                   project.get_property('clean_attachable_lib', False),
-                                   project.get_property('use_aws_role'),
-                                   logger)
-    archive_path = '/'.join([library_remote_path.format(env=env, branch=branch).rstrip('/'), archive_name])
+    def resolve(clusters):
+        resolved_clusters = {}
+        for cluster_name in cluster_names:
+            matched_clusters = [(name, cluster_id) for name, cluster_id in clusters if fnmatchcase(name, cluster_name)]
+            if not matched_clusters:
+                raise Exception(f'No clusters with name {cluster_name} were found.')
+            if len(matched_clusters) > 1 and not any(char in cluster_name for char in '*?['):
+                raise Exception(f'More than 1 cluster was named {cluster_name}: '
+                                f'{", ".join(cluster_id for _, cluster_id in matched_clusters)}.')
+            resolved_clusters.update((cluster_id, name) for name, cluster_id in matched_clusters)
+
+        return sorted((name, cluster_id) for cluster_id, name in resolved_clusters.items())
+
+    return _CachedLookup(state_cache, cache_key, list_clusters, resolve)
 
-    libraries_client = LibrariesApi(db_client)
-    _detach_old_lib_from_cluster(libraries_client, cluster_id, project, logger)
-    cluster_init_timeout = project.get_property('cluster_init_timeout')
-    _start_cluster(cluster_client, cluster_id, cluster_init_timeout, logger)
-    _attach_lib_to_cluster(libraries_client, cluster_id, archive_path, logger)
+
+def _get_current_cluster_id(clusters, resolved_clusters, cluster_name, cluster_id):
+    """
+    Maps the id of a cluster resolved by the build to its id in the current listing. The id is kept if the cluster
+    still exists, a recreated cluster is mapped to the new cluster of the same name if that name is unambiguous.
+    """
+    if any(resolved_id == cluster_id for _, resolved_id in resolved_clusters):
+        return cluster_id
+
+    known_ids = {known_id for _, known_id in clusters}
+    previous_ids = [known_id for name, known_id in clusters if name == cluster_name]
+    new_ids = [resolved_id for name, resolved_id in resolved_clusters
+               if name == cluster_name and resolved_id not in known_ids]
+    if len(previous_ids) != 1 or len(new_ids) != 1:
+        raise Exception(f'The cluster {cluster_name} ({cluster_id}) no longer exists.')
+    return new_ids[0]
+
+
+def _install_library_to_cluster(project, cluster_client, libraries_client, cluster_id, library_path, library_s3_path,
+                                archive_path, upload_archive, logger):
+    installed_libraries = _get_installed_libraries(project)
+    installed_library_key = '/'.join(['libraries', project.get_property('databricks_credentials').get(
+        project.get_property('env')).get('host'), cluster_id, library_path])
+    if _get_bool_property(project, 'skip_unchanged_library', True) and _is_library_unchanged(
+            libraries_client, cluster_id, library_path, project.name, library_s3_path, archive_path,
+            project.get_property('use_aws_role'), logger, installed_libraries.get(installed_library_key)):
+        logger.info(f'\nThe library {library_path} is already attached to the cluster {cluster_id}. Skipping...\n')
+        return 'UNCHANGED'
+
+    # the record is dropped until the new archive is attached, an interrupted installation is repeated
+    installed_libraries.invalidate(installed_library_key)
+
+    # the cluster start and the archive upload don't depend on each other, so they might run at the same time
+    stages = [
+        ('upload_archive', [], lambda results: upload_archive()),
+        ('detach_old_lib', [], lambda results: _detach_old_lib_from_cluster(
+            libraries_client, cluster_id, project, logger)),
+        ('start_cluster', ['detach_old_lib'], lambda results: _start_cluster(
+            cluster_client, cluster_id, project.get_property('cluster_init_timeout'), logger,
+            project.get_property('cluster_poll_interval', 2),
+            project.get_property('cluster_poll_max_interval', 30))),
+        ('attach_lib', ['start_cluster', 'upload_archive'], lambda results: _attach_lib_to_cluster(
+            libraries_client, cluster_id, library_path, logger)),
+    ]
+    _run_stages(stages, _get_bool_property(project, 'parallel_install_stages'), logger)
 
     if [lib for lib in libraries_client.cluster_status(cluster_id)['library_statuses'] if
             lib['status'] == 'UNINSTALL_ON_RESTART']:
         cluster_client.restart_cluster(cluster_id)
-        logger.info(f'\nThe the cluster "{cluster_name}" is restarting...')
+        logger.info(f'\nThe the cluster {cluster_id} is restarting...')
+
+    if _get_bool_property(project, 'wait_for_library_install'):
+        _wait_for_library_install(libraries_client, cluster_id, library_path,
+                                  project.get_property('library_install_timeout', 10 * 60), logger,
+                                  project.get_property('cluster_poll_interval', 2),
+                                  project.get_property('cluster_poll_max_interval', 30))
+
+    installed_libraries.set(installed_library_key, _get_archive_sha256(archive_path))
+    logger.info(f'\nThe library has been installed to the cluster {cluster_id}.\n')
+    return 'INSTALLED'
+
+
+def _get_installed_libraries(project):
+    """
+    Returns the records of the archives attached to the clusters by this machine: the sha256 of the archive
+    per host, cluster and library path. The records never expire.
+    """
+    path = project.expand_path(project.get_property('installed_libraries_path'))
+    with _state_caches_lock:
+        if path not in _state_caches:
+            _state_caches[path] = _StateCache(path, float('inf'))
+        return _state_caches[path]
+
+
+def _is_library_unchanged(libraries_client, cluster_id, library_path, project_name, library_s3_path, archive_path,
+                          aws_profile, logger, installed_sha256=None):
+    """
+    Checks whether the archive is already attached to the cluster, so the upload, detach, attach and restart aren't needed.
+    The attached library must be the only one of the project, the archive recorded when it was attached
+    must have the sha256 of the local one, and so must the s3 object the cluster loads the library from on a restart.
+    A dev version reuses the archive name, so the library path alone doesn't tell which build the cluster runs.
+    """
+    archive_sha256 = _get_archive_sha256(archive_path)
+    if installed_sha256 != archive_sha256:
+        return False
 
-    logger.info(f'\nThe library has been installed to the cluster "{cluster_name}".\n')
+    library_statuses = libraries_client.cluster_status(cluster_id).get('library_statuses', [])
+    project_libraries = [library for library in library_statuses
+                         if project_name in library['library'].get('whl', '')]
+    if [library['library'].get('whl') for library in project_libraries] != [library_path]:
+        return False
+    if project_libraries[0].get('status') in ('UNINSTALL_ON_RESTART', 'FAILED', 'SKIPPED'):
+        return False
 
+    _, bucket_name, archive_key = _get_s3_location(library_s3_path, os.path.basename(archive_path))
+    return _is_s3_object_identical(_get_s3_client(aws_profile, logger), bucket_name, archive_key, archive_path,
+                                   archive_sha256, logger)
 
-def _upload_archive(library_s3_path, project_dist_path, clean_attachable_lib, aws_profile, logger):
+
+def _run_stages(stages, parallel, logger):
+    """
+    Runs a dependency graph of stages and returns their results by name.
+    The stages are (name, dependencies, action) tuples listed in a topological order,
+    an action receives the results of the finished stages.
+    The stages are run in the listed order unless the parallel flag is set.
+    """
+    results, durations = {}, {}
+
+    def run_stage(name, action, dependency_futures):
+        for dependency_future in dependency_futures:
+            dependency_future.result()
+        start_time = time.time()
+        results[name] = action(results)
+        durations[name] = time.time() - start_time
+
+    if parallel:
+        futures = {}
+        with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+            for name, dependencies, action in stages:
+                futures[name] = executor.submit(run_stage, name, action, [futures[dep] for dep in dependencies])
+        for future in futures.values():
+            future.result()
+    else:
+        for name, _, action in stages:
+            run_stage(name, action, [])
+
+    logger.info('Stage durations: ' + ', '.join(f'{name} {duration:.1f}s' for name, duration in durations.items()))
+    return results
+
+
+def _find_archive(project_dist_path, project_name, logger):
+    """
+    Returns the path of the newest whl archive of the project in the dist folder.
+    Archives are ordered by modification time, then by name, so the choice doesn't depend on the listing order.
+    """
     logger.info('Searching a built archive...')
-    project_path = os.path.join(project_dist_path, 'dist')
+    dist_path = os.path.join(project_dist_path, 'dist')
+    # the wheel file names escape dashes and dots of the distribution name
+    distribution_name = re.sub(r'[-_.]+', '_', project_name).lower()
+    with os.scandir(dist_path) as entries:
+        archives = [entry for entry in entries if entry.is_file() and entry.name.endswith('.whl') and (
+            re.sub(r'[-_.]+', '_', entry.name.split('-')[0]).lower() == distribution_name)]
+    if not archives:
+        raise Exception(f'No whl archive of the "{project_name}" project found in {dist_path}.')
 
-    lib_archive = next(os.scandir(project_path))
-    project_path = lib_archive.path
-    archive_name = lib_archive.name
-    logger.info(f'Found the dist "{project_path}".')
+    archive = max(archives, key=lambda entry: (entry.stat().st_mtime_ns, entry.name))
+    logger.info(f'Found the dist "{archive.path}".')
+    return archive.path
 
+
+def _get_archive_sha256(archive_path):
+    stat = os.stat(archive_path)
+    return _cached_file_sha256(archive_path, stat.st_size, stat.st_mtime_ns)
+
+
+def _get_s3_location(library_s3_path, archive_name):
+    bucket_name = library_s3_path.split('/')[2]
     remote_path = library_s3_path.strip('/') if library_s3_path.endswith('/') else library_s3_path
     remote_path = '/'.join([remote_path, archive_name])
+    return remote_path, bucket_name, remote_path.replace(f's3://{bucket_name}/', '')
+
+
+def _upload_archive(library_s3_path, archive_path, clean_attachable_lib, aws_profile, logger,
+                    transfer_config=None):
+    project_path = archive_path
+    archive_name = os.path.basename(archive_path)
+
+    remote_path, bucket_name, archive_key = _get_s3_location(library_s3_path, archive_name)
     logger.info(f'Uploading the file: {remote_path}...')
 
-    if aws_profile:
-        session = boto3.Session(profile_name=aws_profile)
-        s3_client = session.client('s3')
-        logger.info(f'Using {aws_profile} AWS profile...')
-    else:
-        s3_client = boto3.client('s3')
-        logger.info('Using default AWS profile...')
-    bucket_name = library_s3_path.split('/')[2]
+    # the key is reused by every build of a version, so the object is always checked with a HEAD request
+    archive_sha256 = _get_archive_sha256(project_path)
+    s3_client = _get_s3_client(aws_profile, logger)
+    if _is_s3_object_identical(s3_client, bucket_name, archive_key, project_path, archive_sha256, logger):
+        logger.info(f'The archive {archive_name} is already uploaded. Skipping...')
+        return archive_name
 
     if clean_attachable_lib:
         prefix = library_s3_path.replace(f's3://{bucket_name}/', '')
         s3_directory_content_list = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix).get('Contents', [])
 
         if s3_directory_content_list:
-            for content_item in s3_directory_content_list:
-                if archive_name in content_item['Key']:
-                    logger.info(f'The archive {archive_name} is already uploaded. Skipping...')
-                    return archive_name
             delete_objects = {'Objects': [{'Key': file['Key']} for file in s3_directory_content_list]}
             s3_client.delete_objects(Bucket=bucket_name, Delete=delete_objects)
 
-    s3_client.upload_file(Filename=project_path,
-                          Bucket=bucket_name,
-                          Key=remote_path.replace(f's3://{bucket_name}/', ''))
+    with _deploy_metrics.measure('s3 upload_file', remote_path, os.path.getsize(project_path), composite=True):
+        s3_client.upload_file(Filename=project_path,
+                              Bucket=bucket_name,
+                              Key=archive_key,
+                              ExtraArgs={'Metadata': {'sha256': archive_sha256}},
+                              Config=transfer_config)
 
     return archive_name
 
 
-def _start_cluster(cluster_client, cluster_id, init_timeout, logger):
-    logger.info('Starting the cluster...')
-    cluster_state = cluster_client.get_cluster(cluster_id)['state']
-    logger.info(f'The cluster {cluster_id} is {cluster_state}...')
-
-    if cluster_state == 'RUNNING':
-        pass
-    elif cluster_state == 'RESTARTING' or cluster_state == 'PENDING':
-        logger.info(f'The cluster {cluster_id} is restarting. Waiting for a running state...')
-    elif cluster_state == 'TERMINATING':
-        logger.info(f'The cluster {cluster_id} is terminating. Waiting while it\'s shutting down...')
-        start_time = time.time()
-        while cluster_state != 'TERMINATED':
-            time.sleep(3)
-            cluster_state = cluster_client.get_cluster(cluster_id)['state']
-            if time.time() - start_time > init_timeout:
-                raise Exception(f'The cluster {cluster_id} hasn\'t been started in 5 minutes...')
-        logger.info(f'Starting the cluster {cluster_id}...')
-        cluster_client.start_cluster(cluster_id)
-    elif cluster_state == 'TERMINATED':
-        logger.info(f'Starting the cluster {cluster_id}...')
-        cluster_client.start_cluster(cluster_id)
+def _get_s3_client(aws_profile, logger):
+    if aws_profile:
+        session = boto3.Session(profile_name=aws_profile)
+        s3_client = session.client('s3')
+        logger.info(f'Using {aws_profile} AWS profile...')
     else:
-        raise Exception(f'The state of the cluster {cluster_id} cannot be handled: {cluster_state}.')
+        s3_client = boto3.client('s3')
+        logger.info('Using default AWS profile...')
+
+    _deploy_metrics.instrument_boto3_client(s3_client)
+    return s3_client
+
+
+def _get_s3_transfer_config(project):
+    chunk_size = int(project.get_property('s3_multipart_chunksize', 8 * 1024 * 1024))
+    return TransferConfig(multipart_threshold=chunk_size,
+                          multipart_chunksize=chunk_size,
+                          max_concurrency=int(project.get_property('s3_max_concurrency', 10)),
+                          use_threads=_get_bool_property(project, 's3_use_threads', True))
+
+
+def _is_s3_object_identical(s3_client, bucket_name, key, local_path, local_sha256, logger=None):
+    """
+    Compares a local file with the s3 object using a single HEAD request.
+    The sha256 metadata tag is used if present, the ETag is compared with MD5 for single-part uploads otherwise.
+    A forbidden HEAD request (no s3:GetObject, or a missing key without s3:ListBucket) can't verify the object,
+    so the object is considered different and uploaded anyway.
+    """
+    try:
+        remote_object = s3_client.head_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code')
+        if error_code in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        if error_code in ('403', 'AccessDenied', 'Forbidden'):
+            if logger is not None:
+                logger.warn(f'The s3 object s3://{bucket_name}/{key} can\'t be verified: {e}. Uploading it anyway...')
+            return False
+        raise
+
+    if remote_object.get('ContentLength') != os.path.getsize(local_path):
+        return False
+
+    remote_sha256 = remote_object.get('Metadata', {}).get('sha256')
+    if remote_sha256:
+        return remote_sha256 == local_sha256
+
+    etag = remote_object.get('ETag', '').strip('"')
+    if etag and '-' not in etag:
+        md5 = hashlib.md5()
+        with open(local_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                md5.update(chunk)
+        return etag == md5.hexdigest()
+
+    return False
+
+
+def _start_cluster(cluster_client, cluster_id, init_timeout, logger, poll_interval=2, max_poll_interval=30):
+    logger.info('Starting the cluster...')
+    waiter = _ClusterStateWaiter(cluster_client, cluster_id, init_timeout, logger, poll_interval, max_poll_interval)
+    waiter.wait_until_running()
 
-    start_time = time.time()
-    while cluster_state != 'RUNNING':
-        time.sleep(3)
-        cluster_state = cluster_client.get_cluster(cluster_id)['state']
-        if time.time() - start_time > init_timeout:
-            raise Exception(f'The cluster {cluster_id} hasn\'t been started in 5 minutes...')
+    phases = ', '.join(f'{state} {duration:.1f}s' for state, duration in waiter.phase_durations.items())
+    logger.info(f'The cluster {cluster_id} has been started ({phases}).')
+    return waiter
 
-    logger.info(f'The cluster {cluster_id} has been started.')
+
+class _ClusterStateWaiter:
+    """
+    Drives a cluster into the RUNNING state polling it with a jittered exponential backoff.
+    A terminated cluster is started, a terminating one is started once it's terminated,
+    pending, restarting and resizing clusters are awaited.
+    The time spent in every state is collected into phase_durations.
+    """
+
+    WAITING_STATES = ('PENDING', 'RESTARTING', 'RESIZING', 'TERMINATING')
+
+    def __init__(self, cluster_client, cluster_id, timeout, logger, poll_interval=2, max_poll_interval=30,
+                 clock=time.monotonic, sleep=time.sleep, jitter=random.random):
+        self.cluster_client = cluster_client
+        self.cluster_id = cluster_id
+        self.timeout = float(timeout)
+        self.logger = logger
+        self.poll_interval = float(poll_interval)
+        self.max_poll_interval = float(max_poll_interval)
+        self.clock = clock
+        self.sleep = sleep
+        self.jitter = jitter
+        self.phase_durations = {}
+
+    def wait_until_running(self):
+        start_time = self.clock()
+        state, phase_start_time = None, start_time
+        start_requested = False
+        interval = self.poll_interval
+        while True:
+            cluster = _call_in_engine(self.cluster_client.get_cluster, self.cluster_id)
+            new_state = cluster['state']
+            now = self.clock()
+            if new_state != state:
+                if state is not None:
+                    self._record_phase(state, now - phase_start_time)
+                self.logger.info(f'The cluster {self.cluster_id} is {new_state}...')
+                state, phase_start_time = new_state, now
+                interval = self.poll_interval
+
+            if state == 'RUNNING':
+                return self.phase_durations
+            elif state == 'TERMINATED':
+                if start_requested and self.phase_durations.get('PENDING') is not None:
+                    raise Exception(f'The cluster {self.cluster_id} has been terminated while starting: '
+                                    f'{cluster.get("termination_reason", cluster.get("state_message"))}.')
+                if not start_requested:
+                    self.logger.info(f'Starting the cluster {self.cluster_id}...')
+                    self.cluster_client.start_cluster(self.cluster_id)
+                    start_requested = True
+            elif state not in self.WAITING_STATES:
+                raise Exception(f'The state of the cluster {self.cluster_id} cannot be handled: {state}. '
+                                f'{cluster.get("state_message", "")}'.strip())
+
+            remaining_time = self.timeout - (now - start_time)
+            if remaining_time <= 0:
+                self._record_phase(state, now - phase_start_time)
+                raise Exception(f'The cluster {self.cluster_id} hasn\'t been started in {self.timeout:g} seconds...')
+
+            self.sleep(_jittered_delay(interval, self.max_poll_interval, remaining_time, self.jitter))
+            interval *= 2
+
+    def _record_phase(self, state, duration):
+        self.phase_durations[state] = self.phase_durations.get(state, 0.0) + duration
+
+
+def _jittered_delay(interval, max_interval, remaining_time, jitter=random.random):
+    return min(min(interval, max_interval) * (0.5 + jitter() / 2), remaining_time)
 
 
 def _detach_old_lib_from_cluster(client, cluster_id, project, logger):
@@ -302,9 +1809,48 @@ def _attach_lib_to_cluster(client, cluster_id, attachable_lib_path, logger):
     logger.info(f'The library has been attached: {attachable_lib_path}')
 
 
+def _wait_for_library_install(client, cluster_id, library_path, timeout, logger, poll_interval=2, max_poll_interval=30,
+                              clock=time.monotonic, sleep=time.sleep):
+    """
+    Polls the library status until the library is installed on the cluster.
+    Only status transitions are logged. A failed or skipped installation fails the build.
+    """
+    start_time = clock()
+    status = None
+    interval = float(poll_interval)
+    while True:
+        library_statuses = _call_in_engine(client.cluster_status, cluster_id).get('library_statuses', [])
+        library_status = next((library for library in library_statuses
+                               if library['library'].get('whl') == library_path), {})
+        new_status = library_status.get('status', 'NOT_FOUND')
+        now = clock()
+        if new_status != status:
+            logger.info(f'The library {library_path} is {new_status}...')
+            status = new_status
+            interval = float(poll_interval)
+
+        if status == 'INSTALLED':
+            logger.info(f'The library has been installed in {now - start_time:.1f} seconds.')
+            return now - start_time
+        if status in ('FAILED', 'SKIPPED'):
+            messages = '; '.join(library_status.get('messages', []))
+            raise Exception(f'The library {library_path} installation status is {status}: {messages}')
+
+        remaining_time = float(timeout) - (now - start_time)
+        if remaining_time <= 0:
+            raise Exception(f'The library {library_path} hasn\'t been installed in {float(timeout):g} seconds...')
+
+        sleep(_jittered_delay(interval, float(max_poll_interval), remaining_time))
+        interval *= 2
+
+
 @task('export_resources', description='Uploads resources into Databricks hdfs.')
 @depends('post_init')
 def export_resources(project, logger):
+    _run_for_each_env(project, logger, 'export_resources', _export_resources)
+
+
+def _export_resources(project, logger):
     env = project.get_property('env')
     logger.info(f'\nExporting resources to {env.upper()}...\n')
 
@@ -317,13 +1863,195 @@ def export_resources(project, logger):
         dbfs_resources_path = dbfs_resources_path_value.format(env=env)
         project_resources_path = project.get_property('project_resources_path')
 
-        dbfs_client = DbfsApi(_get_databricks_client(project.get_property('databricks_credentials').get(env)))
-        _upload_files_to_dbfs(dbfs_client, project_resources_path, dbfs_resources_path, logger)
+        dbfs_client = DbfsApi(_get_databricks_client(project, env))
+        _upload_files_to_dbfs(dbfs_client, project_resources_path, dbfs_resources_path, logger,
+                              _open_sync_manifest(project, dbfs_resources_path, logger),
+                              _get_bool_property(project, 'delete_removed_files'),
+                              project.get_property('dbfs_upload_workers', 1),
+                              project.get_property('dbfs_large_file_threshold'),
+                              _get_dbfs_block_size(project),
+                              project.get_property('dbfs_block_retries', 3),
+                              _get_tree_scanner(project),
+                              _get_checkpoint_journal(project, logger))
     else:
         logger.info('\nNo resources are to be exported.'
                     ' Set the "with_dbfs_resources" property to True in order to upload resources.\n')
 
 
+@task('prune_workspace', description='Deleting remote workspace files and branches which no longer exist locally.')
+@depends('post_init')
+def prune_workspace(project, logger):
+    _run_for_each_env(project, logger, 'prune_workspace', _prune_workspace)
+
+
+def _prune_workspace(project, logger):
+    env = project.get_property('env')
+    logger.info(f'\nPruning the workspace of {env.upper()}...\n')
+
+    remote_workspace_path = _build_remote_workspace_path(project).rstrip('/')
+    workspace_client = WorkspaceApi(_get_databricks_client(project, env))
+    workers = project.get_property('prune_workers', 1)
+    dry_run = _get_bool_property(project, 'prune_dry_run')
+
+    def list_children(remote_path):
+        return [(entry.path, entry.object_type == 'DIRECTORY')
+                for entry in _list_if_exists(lambda: workspace_client.list_objects(remote_path))]
+
+    def delete(remote_path, is_directory):
+        workspace_client.delete(workspace_path=remote_path, is_recursive=is_directory)
+
+    local_files, local_directories = _scan_remote_paths(
+        _get_tree_scanner(project).scan(project.get_property('project_workspace_path'), remote_workspace_path,
+                                        strip_extensions=True))
+    env_config_name = project.get_property('env_config_name')
+    if project.get_property('enable_env_sensitive_workspace_properties') and env_config_name:
+        local_files.add('/'.join([remote_workspace_path, env_config_name]))
+
+    orphans = _find_orphans(list_children, remote_workspace_path,
+                            _tree_classifier(local_files, local_directories), workers, logger)
+
+    active_branches = _get_list_property(project, 'prune_active_branches')
+    if active_branches and project.get_property('include_git_branch_into_output_workspace_path', False):
+        branch = project.get_property('branch')
+        branches_path = remote_workspace_path[:-len(f'/{branch}')]
+        orphans += _find_orphans(list_children, branches_path,
+                                 _branch_classifier(branches_path, set(active_branches) | {branch}), workers, logger)
+
+    try:
+        _delete_orphans(orphans, delete, workers, dry_run, logger)
+    finally:
+        if not dry_run:
+            _forget_pruned_paths(project, [remote_path for remote_path, _ in orphans], False, logger)
+
+
+@task('prune_resources', description='Deleting remote dbfs resources which no longer exist locally.')
+@depends('post_init')
+def prune_resources(project, logger):
+    _run_for_each_env(project, logger, 'prune_resources', _prune_resources)
+
+
+def _prune_resources(project, logger):
+    env = project.get_property('env')
+    if not project.get_property('with_dbfs_resources', False):
+        logger.info('\nNo resources are to be pruned. Set the "with_dbfs_resources" property to True.\n')
+        return
+
+    dbfs_resources_path_value = project.get_property('dbfs_resources_path')
+    if dbfs_resources_path_value is None:
+        raise Exception('The "dbfs_resources_path" property is not specified.'
+                        'For example: dbfs:/FileStore/tables/project_name/resources/{env}')
+
+    logger.info(f'\nPruning the resources of {env.upper()}...\n')
+    dbfs_resources_path = DbfsPath(dbfs_resources_path_value.format(env=env)).absolute_path.rstrip('/')
+    dbfs_client = DbfsApi(_get_databricks_client(project, env))
+
+    def list_children(remote_path):
+        return [(entry.dbfs_path.absolute_path, entry.is_dir)
+                for entry in _list_if_exists(lambda: dbfs_client.list_files(DbfsPath(remote_path)))]
+
+    def delete(remote_path, is_directory):
+        dbfs_client.delete(DbfsPath(remote_path), recursive=is_directory)
+
+    local_files, local_directories = _scan_remote_paths(
+        _get_tree_scanner(project).scan(project.get_property('project_resources_path'), dbfs_resources_path))
+    workers = project.get_property('prune_workers', 1)
+    orphans = _find_orphans(list_children, dbfs_resources_path,
+                            _tree_classifier(local_files, local_directories), workers, logger)
+    dry_run = _get_bool_property(project, 'prune_dry_run')
+    try:
+        _delete_orphans(orphans, delete, workers, dry_run, logger)
+    finally:
+        if not dry_run:
+            _forget_pruned_paths(project, [remote_path for remote_path, _ in orphans], True, logger)
+
+
+def _scan_remote_paths(entries):
+    files, directories = set(), set()
+    for entry in entries:
+        (directories if entry.is_directory else files).add(entry.remote_path)
+    return files, directories
+
+
+def _list_if_exists(list_directory):
+    try:
+        return list_directory()
+    except requests.HTTPError as e:
+        if getattr(e.response, 'status_code', None) == 404:
+            return []
+        raise
+
+
+def _tree_classifier(local_files, local_directories):
+    """
+    Keeps the remote files existing locally and descends into the existing directories, everything else is an orphan.
+    """
+    def classify(remote_path, is_directory):
+        if is_directory:
+            return 'descend' if remote_path in local_directories else 'orphan'
+        return 'keep' if remote_path in local_files else 'orphan'
+
+    return classify
+
+
+def _branch_classifier(branches_path, active_branches):
+    """
+    Keeps the directories of the active branches, a branch name with slashes is a nested directory.
+    """
+    def classify(remote_path, is_directory):
+        relative_path = remote_path[len(branches_path):].strip('/')
+        if relative_path in active_branches:
+            return 'keep'
+        if is_directory and any(branch.startswith(relative_path + '/') for branch in active_branches):
+            return 'descend'
+        return 'orphan'
+
+    return classify
+
+
+def _find_orphans(list_children, root_path, classify, workers, logger):
+    """
+    Lists the remote tree level by level, the directories of a level are listed concurrently.
+    Orphaned directories are not listed, they are deleted as a whole with a single recursive call.
+    """
+    orphans = []
+    lock = threading.Lock()
+    next_level = []
+
+    def list_directory(remote_path):
+        for path, is_directory in list_children(remote_path):
+            decision = classify(path.rstrip('/'), is_directory)
+            with lock:
+                if decision == 'orphan':
+                    orphans.append((path, is_directory))
+                elif decision == 'descend':
+                    next_level.append(path)
+
+    level = [root_path]
+    while level:
+        next_level = []
+        _run_concurrently(list_directory, level, workers, 'list the directory', logger)
+        level = next_level
+
+    logger.info(f'Found {len(orphans)} orphaned remote entries under {root_path}.')
+    return sorted(orphans)
+
+
+def _delete_orphans(orphans, delete, workers, dry_run, logger):
+    def delete_orphan(orphan):
+        remote_path, is_directory = orphan
+        delete(remote_path, is_directory)
+        logger.info(f'The orphaned {"directory" if is_directory else "file"} has been deleted: {remote_path}.')
+
+    if dry_run:
+        for remote_path, is_directory in orphans:
+            logger.info(f'The orphaned {"directory" if is_directory else "file"} would be deleted: {remote_path}.')
+        logger.info('\nNothing has been deleted, the "prune_dry_run" property is set.\n')
+        return
+
+    _run_concurrently(delete_orphan, orphans, workers, 'delete the orphan', logger)
+    logger.info(f'\n{len(orphans)} orphaned remote entries have been deleted.\n')
+
+
 @task('deploy_to_cluster',
       description='Deploy all the assets and install a built whl archive to the databricks cluster.')
 @depends('export_workspace', 'export_resources', 'install_library')
@@ -334,6 +2062,10 @@ def deploy_to_cluster(project, logger):
 @task('deploy_job', description='Deploy the databricks job entirely using a job definition config.')
 @depends('export_workspace', 'export_resources')
 def deploy_job(project, logger):
+    _run_for_each_env(project, logger, 'deploy_job', _deploy_job)
+
+
+def _deploy_job(project, logger):
     env = project.get_property('env')
     branch = project.get_property('branch')
     logger.info(f'\nDeploying the job to {env.upper()}...\n')
@@ -347,14 +2079,17 @@ def deploy_job(project, logger):
         raise Exception('The "library_remote_path" property is not set...\n')
 
     databricks_credentials = project.get_property('databricks_credentials').get(env)
-    db_client = _get_databricks_client(databricks_credentials)
+    db_client = _get_databricks_client(project, env)
+    state_cache = _get_state_cache(project)
+    journal = _get_checkpoint_journal(project, logger)
 
     # the lib path is pointing to Volume for defined envs
     archive_name = _upload_archive(library_s3_path.format(env=env, branch=branch),
-                                   project.expand_path('$dir_dist'),
+                                   _find_archive(project.expand_path('$dir_dist'), project.name, logger),
                                    project.get_property('clean_attachable_lib', False),
                                    project.get_property('use_aws_role'),
-                                   logger) if env in project.get_property('attachable_lib_envs') else 'N/A'
+                                   logger,
+                                   _get_s3_transfer_config(project)) if env in project.get_property('attachable_lib_envs') else 'N/A'
 
     if archive_name == 'N/A':
         logger.info(f'The archive_path /{env}/{branch}/{archive_name} would be ignored.')
@@ -371,63 +2106,594 @@ def deploy_job(project, logger):
     else:
         logger.info('No extra arguments for the job definition found.')
 
-    job_definition_path = project.expand_path(project.get_property('job_definition_path'))
-    job_definitions = _read_job_definition(job_definition_path, rendering_args)
-    job_definitions_json = json.loads(job_definitions)
-    # wrap a single definition into a list for multiple definitions support
-    if type(job_definitions_json) == dict:
-        job_definitions_json = [job_definitions_json]
-
-    jobs_client = JobsApi(db_client)
-
     deploy_single_job = project.get_property('deploy_single_job')
     if deploy_single_job:
         logger.info(f'Deploying a single job: {deploy_single_job}...')
 
+    job_definition_path = project.expand_path(project.get_property('job_definition_path'))
+    template_cache_path = project.get_property('job_template_cache_path')
+    template_cache_dir = project.expand_path(template_cache_path) if template_cache_path else None
+    job_definitions_json = _read_job_definitions(job_definition_path, rendering_args, deploy_single_job,
+                                                 template_cache_dir, logger)
+
+    jobs_client = JobsApi(db_client)
+
+    job_definitions = {}
     for job_definition in job_definitions_json:
         job_name = job_definition.get('name') if 'name' in job_definition else job_definition.get('settings', []).get('name')
         if deploy_single_job and deploy_single_job != job_name:
             logger.info(f'Skipping the job deployment: {job_name}...')
             continue
+        job_definitions[job_name] = job_definition
+
+    # the remote jobs are listed once and shared by all the definitions
+    databricks_host = databricks_credentials.get('host')
+    jobs_cache_key = f'jobs/{databricks_host}'
+    job_lookup = _CachedLookup(state_cache, jobs_cache_key,
+                               lambda: _build_job_index(jobs_client, project.get_property('jobs_list_page_size', 25), logger),
+                               lambda job_index: {job_name: _get_job_id_by_name(job_index, job_name, databricks_host)
+                                                  for job_name in job_definitions}) if job_definitions else None
+    job_ids = job_lookup.values if job_lookup is not None else {}
+    jobs_to_deploy = {}
+    resumed_jobs = []
+    for job_name, job_definition in job_definitions.items():
+        logger.info(f'Found the job "{job_name}": {databricks_host}/#job/{job_ids[job_name]}')
+        if journal is not None and journal.is_completed(
+                f'job:{job_name}', _get_settings_digest([job_ids[job_name], job_definition])):
+            logger.info(f'The job "{job_name}" has been reset by a previous build. Skipping...')
+            resumed_jobs.append(job_name)
+            continue
+        jobs_to_deploy[job_name] = (job_ids[job_name], job_definition)
 
-        logger.info(f'Looking for the job: "{job_name}"...')
-        databricks_host = databricks_credentials.get('host')
-        job_id = _get_job_id_by_name(jobs_client, job_name, databricks_host)
-        logger.info(f'Found the job: {databricks_host}/#job/{job_id}')
+    workers = project.get_property('job_deploy_workers', 1)
+    retries = project.get_property('job_deploy_retries', 3)
 
+    def reset_job_id(job_name, job_id):
         new_job_definition = {
             'job_id': job_id,
-            'new_settings': job_definition
+            'new_settings': jobs_to_deploy[job_name][1]
         }
-        jobs_client.reset_job(new_job_definition)
+        _call_with_retries(lambda: jobs_client.reset_job(new_job_definition), retries,
+                           f'reset the job "{job_name}"', logger, is_retryable=_is_rate_limited)
+        return job_id
+
+    def reset_job(job_name):
+        # a cached id of a recreated job is resolved again by the name
+        job_id = job_lookup.call(lambda resolved_job_ids: reset_job_id(job_name, resolved_job_ids[job_name]))
+        job_definition = jobs_to_deploy[job_name][1]
+        if journal is not None:
+            journal.complete(f'job:{job_name}', _get_settings_digest([job_id, job_definition]))
 
         logger.info(f'The job "{job_name}" has been updated.')
 
+    # the cached job ids are dropped if the jobs can't be fetched or reset, they might have been recreated
+    changed_jobs = list(jobs_to_deploy)
+    with _invalidating(state_cache, jobs_cache_key):
+        if _get_bool_property(project, 'job_diff_only'):
+            changed_jobs = _find_changed_jobs(jobs_client, jobs_to_deploy, workers, retries, logger, job_lookup)
+        _run_concurrently(reset_job, changed_jobs, workers, 'reset the job', logger)
+
+    unchanged_jobs = [job_name for job_name in jobs_to_deploy if job_name not in changed_jobs]
+    if journal is not None:
+        for job_name in unchanged_jobs:
+            journal.complete(f'job:{job_name}', _get_settings_digest([job_lookup.values[job_name],
+                                                                      jobs_to_deploy[job_name][1]]))
 
-def _read_job_definition(job_definition_path, rendering_args):
-    with open(job_definition_path, 'r') as file:
-        raw_job_definition = file.read()
+    if resumed_jobs:
+        logger.info(f'\nJobs reset by a previous build ({len(resumed_jobs)}): {", ".join(resumed_jobs)}')
+    logger.info(f'\nChanged jobs ({len(changed_jobs)}): {", ".join(changed_jobs) or "-"}')
+    logger.info(f'Unchanged jobs ({len(unchanged_jobs)}): {", ".join(unchanged_jobs) or "-"}\n')
 
-        template = Template(raw_job_definition)
-        job_definition = template.render(rendering_args)
-        return job_definition
 
+def _find_changed_jobs(jobs_client, jobs_to_deploy, workers, retries, logger, job_lookup=None):
+    """
+    Fetches the current settings of the jobs concurrently and returns the names of jobs
+    differing from the rendered definitions.
+    """
+    remote_settings = {}
 
-def _get_job_id_by_name(jobs_client, job_name, databricks_host):
-    jobs = jobs_client.list_jobs().get('jobs')
+    def get_job(job_name, job_id):
+        return _call_with_retries(lambda: jobs_client.get_job(job_id), retries, f'get the job "{job_name}"', logger,
+                                  is_retryable=_is_rate_limited)
 
-    found_jobs = [job for job in jobs if job.get('settings').get('name') == job_name]
-    if not found_jobs:
-        raise Exception(f'No {job_name} is found on the host {databricks_host}...')
+    def fetch_settings(job_name):
+        if job_lookup is None:
+            job = get_job(job_name, jobs_to_deploy[job_name][0])
+        else:
+            job = job_lookup.call(lambda resolved_job_ids: get_job(job_name, resolved_job_ids[job_name]))
+        remote_settings[job_name] = job.get('settings', {})
+
+    _run_concurrently(fetch_settings, list(jobs_to_deploy), workers, 'get the job', logger)
+
+    return [job_name for job_name, (_, job_definition) in jobs_to_deploy.items()
+            if not _is_job_settings_matching(job_definition, remote_settings[job_name])]
+
+
+# the settings filled in by Databricks when a job is reset, a remote value is ignored if it's missing locally
+# and equals the default (None accepts any value)
+_job_settings_defaults = {
+    'format': None,
+    'max_concurrent_runs': 1,
+    'timeout_seconds': 0,
+    'run_if': 'ALL_SUCCESS',
+    'source': 'WORKSPACE',
+}
+
+
+def _is_job_settings_matching(local_settings, remote_settings):
+    """
+    Compares the rendered settings with the remote ones ignoring empty values and key order.
+    The reset replaces all the settings, so a remote key missing in the rendered settings is a difference,
+    unless it's one of the defaults filled in by Databricks.
+    """
+    local_settings = _normalize_job_settings(local_settings)
+    remote_settings = _normalize_job_settings(remote_settings)
+    if isinstance(local_settings, dict) and isinstance(remote_settings, dict):
+        return all(key in remote_settings and _is_job_settings_matching(value, remote_settings[key])
+                   for key, value in local_settings.items()) and all(
+            key in local_settings or _is_job_settings_default(key, value) for key, value in remote_settings.items())
+    if isinstance(local_settings, list) and isinstance(remote_settings, list):
+        return len(local_settings) == len(remote_settings) and all(
+            _is_job_settings_matching(local_item, remote_item)
+            for local_item, remote_item in zip(local_settings, remote_settings))
+
+    return local_settings == remote_settings
+
+
+def _is_job_settings_default(key, value):
+    return key in _job_settings_defaults and _job_settings_defaults[key] in (None, value)
+
+
+def _normalize_job_settings(settings):
+    if isinstance(settings, dict):
+        normalized = {key: _normalize_job_settings(value) for key, value in settings.items()}
+        return {key: value for key, value in normalized.items() if value not in (None, '', {}, [])}
+    if isinstance(settings, list):
+        return [_normalize_job_settings(item) for item in settings]
+
+    return settings
+
+
+def _is_rate_limited(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) in (429, 503)
 
-    job_id = found_jobs[0]['job_id']
+
+_jinja_environments = {}
+_jinja_environments_lock = threading.Lock()
+
+
+def _get_jinja_environment(template_dir, cache_dir=None):
+    """
+    Returns the Jinja environment of the templates directory shared by all the envs of the build.
+    Compiled templates are kept in memory and in the on-disk bytecode cache, which is validated
+    by the checksum of the template source, so unchanged templates are not parsed again by later builds.
+    """
+    cache_key = (os.path.abspath(template_dir), cache_dir)
+    with _jinja_environments_lock:
+        if cache_key not in _jinja_environments:
+            bytecode_cache = None
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+                bytecode_cache = FileSystemBytecodeCache(cache_dir)
+            _jinja_environments[cache_key] = Environment(loader=FileSystemLoader(template_dir),
+                                                         bytecode_cache=bytecode_cache)
+        return _jinja_environments[cache_key]
+
+
+def _read_job_definitions(job_definition_path, rendering_args, selected_job_name=None, cache_dir=None, logger=None):
+    """
+    Renders the job definitions of a file, or of a directory of per-job templates.
+    The top-level json files of a directory are templates of separate jobs, subdirectories may hold included parts.
+    A template named after the selected job is the only one rendered, others are rendered if no template matches.
+    """
+    if os.path.isdir(job_definition_path):
+        template_dir = job_definition_path
+        template_names = sorted(name for name in os.listdir(template_dir)
+                                if name.endswith('.json') and os.path.isfile(os.path.join(template_dir, name)))
+        if selected_job_name and f'{selected_job_name}.json' in template_names:
+            template_names = [f'{selected_job_name}.json']
+    else:
+        template_dir, template_name = os.path.split(job_definition_path)
+        template_names = [template_name]
+
+    environment = _get_jinja_environment(template_dir or '.', cache_dir)
+    job_definitions = []
+    for template_name in template_names:
+        if logger:
+            logger.info(f'Rendering the job definition: {os.path.join(template_dir, template_name)}...')
+        job_definition = json.loads(environment.get_template(template_name).render(rendering_args))
+        # wrap a single definition into a list for multiple definitions support
+        job_definitions.extend([job_definition] if isinstance(job_definition, dict) else job_definition)
+    return job_definitions
+
+
+def _build_job_index(jobs_client, page_size, logger):
+    """
+    Lists all the remote jobs page by page and indexes their ids by name.
+    Jobs sharing the same name are reported, the first found job is used for such names.
+    """
+    job_ids_by_name = {}
+    offset = 0
+    while True:
+        response = jobs_client.list_jobs(offset=offset, limit=int(page_size))
+        jobs = response.get('jobs', [])
+        for job in jobs:
+            job_ids_by_name.setdefault(job.get('settings', {}).get('name'), []).append(job['job_id'])
+
+        offset += len(jobs)
+        if not jobs or not response.get('has_more'):
+            break
+
+    logger.info(f'Found {offset} jobs on the host.')
+    for job_name, job_ids in job_ids_by_name.items():
+        if len(job_ids) > 1:
+            logger.warn(f'The job name "{job_name}" is not unique: {job_ids}. The job {job_ids[0]} is used.')
+
+    return {job_name: job_ids[0] for job_name, job_ids in job_ids_by_name.items()}
+
+
+def _get_job_id_by_name(job_index, job_name, databricks_host):
+    job_id = job_index.get(job_name)
+    if job_id is None:
+        raise Exception(f'No {job_name} is found on the host {databricks_host}...')
 
     return job_id
 
 
-def _get_databricks_client(env_credentials):
-    return ApiClient(host=env_credentials.get('host'),
-                     token=env_credentials.get('token'))
+def _get_bool_property(project, name, default=False):
+    # properties passed with the -P parameter are strings
+    value = project.get_property(name, default)
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', 'yes', '1')
+
+    return bool(value)
+
+
+def _get_list_property(project, name, default=None):
+    # properties passed with the -P parameter are comma separated strings
+    value = project.get_property(name, default)
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(',') if item.strip()]
+
+    return list(value) if value else []
+
+
+_databricks_clients = {}
+_databricks_clients_lock = threading.Lock()
+
+
+def _get_databricks_client(project, env):
+    """
+    Returns the api client of the env shared by all the tasks of the build.
+    The client keeps a pool of connections sized to the calls in flight: the largest number of workers,
+    or the concurrency of the asyncio engine if it's used. It retries rate-limited (429)
+    and unavailable (503) responses respecting the Retry-After header, and limits the request rate if configured.
+    """
+    env_credentials = project.get_property('databricks_credentials').get(env)
+    pool_size = int(project.get_property('databricks_api_pool_size') or _get_default_pool_size(project))
+    cache_key = (env, env_credentials.get('host'), env_credentials.get('token'), pool_size)
+    with _databricks_clients_lock:
+        if cache_key not in _databricks_clients:
+            client = ApiClient(host=env_credentials.get('host'),
+                               token=env_credentials.get('token'))
+            # the api client drops the port of the host, it's kept for proxies and private endpoints
+            parsed_host = urlparse(env_credentials.get('host'))
+            client.url = f'{parsed_host.scheme}://{parsed_host.netloc}/api/'
+
+            retries = _MeasuredRetry(total=int(project.get_property('databricks_api_retries', 6)),
+                                     backoff_factor=1,
+                                     status_forcelist=[429, 503],
+                                     allowed_methods=None,
+                                     respect_retry_after_header=True,
+                                     raise_on_status=False)
+            adapter = TlsV1HttpAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+            client.session.mount('https://', adapter)
+            client.session.mount('http://', adapter)
+
+            client.perform_query = _deploy_metrics.instrument_perform_query(client.perform_query, env)
+            rate_limit = project.get_property('databricks_api_rate_limit')
+            if rate_limit:
+                client.perform_query = _RateLimiter(float(rate_limit)).wrap(client.perform_query)
+
+            _databricks_clients[cache_key] = client
+
+        return _databricks_clients[cache_key]
+
+
+def _get_default_pool_size(project):
+    worker_counts = [int(project.get_property(name, 1) or 1)
+                     for name in ('workspace_upload_workers', 'dbfs_upload_workers', 'job_deploy_workers')]
+    # the asyncio engine runs up to async_concurrency calls at once whatever the worker counts are
+    if str(project.get_property('deploy_engine', 'threads') or 'threads').lower() == 'asyncio':
+        worker_counts.append(max(1, int(project.get_property('async_concurrency', 32) or 1)))
+    return max(worker_counts + [10])
+
+
+class _RateLimiter:
+    """
+    A token bucket limiting the number of calls per second across all the threads sharing it.
+    The bucket holds at least one token, so a rate below one call per second still lets the calls through.
+    """
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            self.sleep(delay)
+            _deploy_metrics.record_queue_wait(delay)
+
+    def wrap(self, call):
+        def limited_call(*args, **kwargs):
+            self.acquire()
+            return call(*args, **kwargs)
+
+        return limited_call
+
+
+class _MeasuredRetry(Retry):
+    """
+    Counts the retries of http requests done by urllib3.
+    """
+
+    def increment(self, method=None, url=None, *args, **kwargs):
+        _deploy_metrics.record_retry(f'{method} {_get_api_path(url)}')
+        return super().increment(method, url, *args, **kwargs)
+
+
+def _get_api_path(url):
+    return re.sub(r'^(https?://[^/]+)?/api/[^/]+', '', url or '')
+
+
+class _DeployMetrics:
+    """
+    Collects latency, transferred bytes, retries and errors of the remote calls, and queue waits of the thread pools.
+    The calls are grouped by phases, a phase is a task run.
+    A composite call (a file upload made of several requests) carries the bytes of the file, the requests within it
+    carry none, and it's left out of the call totals, so neither bytes nor calls are counted twice.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phase = None
+        self.phase_started_at = None
+        self.calls = []
+        self.retries = {}
+        self.queue_waits = []
+
+    def start_phase(self, phase):
+        with self._lock:
+            self.phase = phase
+            self.phase_started_at = time.time()
+            self.calls, self.retries, self.queue_waits = [], {}, []
+
+    def record(self, call_type, duration, size=0, label=None, env=None, failed=False, composite=False):
+        with self._lock:
+            self.calls.append({'type': call_type, 'duration': duration, 'bytes': size, 'label': label,
+                               'env': env, 'failed': failed, 'composite': composite})
+
+    def record_retry(self, call_type, count=1):
+        with self._lock:
+            self.retries[call_type] = self.retries.get(call_type, 0) + count
+
+    def record_queue_wait(self, duration):
+        with self._lock:
+            self.queue_waits.append(duration)
+
+    @contextmanager
+    def measure(self, call_type, label=None, size=0, env=None, composite=False):
+        start_time = time.monotonic()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.record(call_type, time.monotonic() - start_time, size, label, env, failed, composite)
+
+    def instrument_perform_query(self, perform_query, env):
+        def measured_perform_query(method, path, data={}, *args, **kwargs):
+            query_data = data or {}
+            label = next((query_data[key] for key in ('path', 'job_id', 'cluster_id', 'handle') if key in query_data),
+                         None)
+            # the blocks of a streamed file are counted by the composite call of the file
+            size = len(query_data['content']) if isinstance(query_data.get('content'), str) else 0
+            with self.measure(f'{method} {path}', label, size, env):
+                return perform_query(method, path, data, *args, **kwargs)
+
+        return measured_perform_query
+
+    def instrument_boto3_client(self, client):
+        def before_call(model, params, context, **kwargs):
+            context['measure_started_at'] = time.monotonic()
+            context['measure_label'] = params.get('Key') or params.get('Bucket')
+
+        def after_call(model, parsed, context, **kwargs):
+            if 'measure_started_at' in context:
+                call_type = f's3 {model.name}'
+                duration = time.monotonic() - context['measure_started_at']
+                self.record(call_type, duration, parsed.get('ContentLength', 0) if model.name != 'HeadObject' else 0,
+                            context.get('measure_label'), failed='Error' in parsed)
+                retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+                if retries:
+                    self.record_retry(call_type, retries)
+
+        client.meta.events.register('before-call.s3', before_call)
+        client.meta.events.register('after-call.s3', after_call)
+
+    def report(self):
+        with self._lock:
+            calls, retries, queue_waits = list(self.calls), dict(self.retries), list(self.queue_waits)
+
+        call_types = {}
+        for call in calls:
+            call_types.setdefault(call['type'], []).append(call)
+        requests = [call for call in calls if not call.get('composite')]
+
+        return {
+            'phase': self.phase,
+            'started_at': self.phase_started_at,
+            'wall_time': time.time() - self.phase_started_at if self.phase_started_at else 0.0,
+            'totals': {
+                'calls': len(requests),
+                'failed_calls': sum(call['failed'] for call in requests),
+                'call_time': sum(call['duration'] for call in requests),
+                'bytes': sum(call['bytes'] for call in calls),
+                'retries': sum(retries.values()),
+                'queue_wait': sum(queue_waits),
+                'max_queue_wait': max(queue_waits, default=0.0),
+            },
+            'call_types': {call_type: {
+                'count': len(type_calls),
+                'failed': sum(call['failed'] for call in type_calls),
+                'total': sum(call['duration'] for call in type_calls),
+                'p50': _percentile([call['duration'] for call in type_calls], 50),
+                'p95': _percentile([call['duration'] for call in type_calls], 95),
+                'max': max(call['duration'] for call in type_calls),
+                'bytes': sum(call['bytes'] for call in type_calls),
+                'retries': retries.get(call_type, 0),
+            } for call_type, type_calls in sorted(call_types.items())},
+            'slowest_calls': sorted((call for call in calls if call['label'] is not None),
+                                    key=lambda call: call['duration'], reverse=True)[:20],
+        }
+
+
+_deploy_metrics = _DeployMetrics()
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    if not values:
+        return 0.0
+
+    return values[max(0, -(-len(values) * percent // 100) - 1)]
+
+
+def _write_deploy_report(project, task_name, logger):
+    report_path = project.get_property('deploy_report_path')
+    if not report_path:
+        return
+
+    report_dir = project.expand_path(report_path)
+    os.makedirs(report_dir, exist_ok=True)
+    report = _deploy_metrics.report()
+    with open(os.path.join(report_dir, f'{task_name}.json'), 'w') as file:
+        json.dump(report, file, indent=2, default=str)
+
+    with open(os.path.join(report_dir, f'{task_name}.csv'), 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['phase', 'call_type', 'count', 'failed', 'total', 'p50', 'p95', 'max', 'bytes', 'retries'])
+        for call_type, stats in report['call_types'].items():
+            writer.writerow([task_name, call_type] + [stats[key] for key in
+                                                      ('count', 'failed', 'total', 'p50', 'p95', 'max', 'bytes',
+                                                       'retries')])
+
+    totals = report['totals']
+    logger.info(f'The deployment report has been written into {report_dir}: {totals["calls"]} remote calls, '
+                f'{totals["bytes"]} bytes, {totals["retries"]} retries in {report["wall_time"]:.1f}s.')
+
+
+@task('deploy_profile', description='Prints the summary of the deployment reports of the executed tasks.')
+def deploy_profile(project, logger):
+    report_dir = project.expand_path(project.get_property('deploy_report_path'))
+    report_names = sorted(name for name in os.listdir(report_dir) if name.endswith('.json')) \
+        if os.path.isdir(report_dir) else []
+    if not report_names:
+        logger.info(f'No deployment reports are found in {report_dir}.')
+        return
+
+    for report_name in report_names:
+        with open(os.path.join(report_dir, report_name), 'r') as file:
+            report = json.load(file)
+
+        totals = report['totals']
+        logger.info(f'\n{report["phase"]}: {report["wall_time"]:.1f}s wall time, {totals["calls"]} calls, '
+                    f'{totals["bytes"]} bytes, {totals["retries"]} retries, {totals["queue_wait"]:.1f}s queue wait')
+        logger.info(f'  {"call type":<45} {"count":>7} {"total":>9} {"p50":>8} {"p95":>8} {"max":>8} {"retries":>7}')
+        for call_type, stats in report['call_types'].items():
+            logger.info(f'  {call_type:<45} {stats["count"]:>7} {stats["total"]:>8.2f}s {stats["p50"]:>7.3f}s '
+                        f'{stats["p95"]:>7.3f}s {stats["max"]:>7.3f}s {stats["retries"]:>7}')
+        for call in report['slowest_calls'][:5]:
+            logger.info(f'  slowest: {call["type"]} {call["label"]} {call["duration"]:.3f}s')
+
+
+@task('deploy_benchmark', description='Benchmarks the deployment tasks against local fake Databricks and s3 endpoints.')
+def deploy_benchmark(project, logger):
+    import databricks_pybuilder_benchmark as benchmark
+
+    scenario_names = _get_list_property(project, 'benchmark_scenarios')
+    unknown_scenarios = [name for name in scenario_names if name not in benchmark.SCENARIOS]
+    if unknown_scenarios:
+        raise Exception(f'Unknown benchmark scenarios: {", ".join(unknown_scenarios)}. '
+                        f'Available scenarios: {", ".join(benchmark.SCENARIOS)}.')
+
+    results = []
+    for scenario_name in scenario_names:
+        logger.info(f'Running the "{scenario_name}" benchmark scenario...')
+        results.append(benchmark.run_scenario(sys.modules[__name__], scenario_name,
+                                              benchmark.SCENARIOS[scenario_name], logger,
+                                              float(project.get_property('benchmark_latency') or 0),
+                                              project.get_property('benchmark_bandwidth'),
+                                              float(project.get_property('benchmark_error_rate') or 0),
+                                              project.get_property('benchmark_properties')))
+
+    for result in results:
+        logger.info(f'\n{result["scenario"]}: {result["settings"]}')
+        logger.info(f'  {"task":<20} {"wall time":>10} {"requests":>9} {"errors":>7} {"peak memory":>12}')
+        for task_result in result['tasks']:
+            peak_memory = f'{task_result["peak_memory"] / 1024 / 1024:.1f}MB' \
+                if task_result['peak_memory'] is not None else '-'
+            logger.info(f'  {task_result["task"]:<20} {task_result["wall_time"]:>9.2f}s {task_result["requests"]:>9} '
+                        f'{task_result["injected_errors"]:>7} {peak_memory:>12} {task_result["error"] or ""}'.rstrip())
+
+    report_dir = project.expand_path(project.get_property('benchmark_report_path'))
+    os.makedirs(report_dir, exist_ok=True)
+    report_path = os.path.join(report_dir, 'benchmark.json')
+    with open(report_path, 'w') as file:
+        json.dump(results, file, indent=2)
+    logger.info(f'\nThe benchmark report has been written into {report_path}.')
+
+    failed_tasks = [f'{result["scenario"]}/{task_result["task"]}' for result in results
+                    for task_result in result['tasks'] if task_result['error']]
+    if failed_tasks:
+        raise Exception(f'The benchmarked tasks have failed: {", ".join(failed_tasks)}.')
+
+    baseline_path = project.get_property('benchmark_baseline_path')
+    if baseline_path:
+        _check_benchmark_regressions(results, project.expand_path(baseline_path),
+                                     float(project.get_property('benchmark_tolerance', 0.2)), logger)
+
+
+def _check_benchmark_regressions(results, baseline_path, tolerance, logger):
+    with open(baseline_path, 'r') as file:
+        baseline = {(result['scenario'], task_result['task']): task_result
+                    for result in json.load(file) for task_result in result['tasks']}
+
+    regressions = []
+    for result in results:
+        for task_result in result['tasks']:
+            baseline_result = baseline.get((result['scenario'], task_result['task']))
+            if baseline_result and task_result['wall_time'] > baseline_result['wall_time'] * (1 + tolerance):
+                regressions.append(f'{result["scenario"]}/{task_result["task"]}: '
+                                   f'{baseline_result["wall_time"]:.2f}s -> {task_result["wall_time"]:.2f}s')
+
+    if regressions:
+        raise Exception('The deployment performance has regressed:\n' + '\n'.join(regressions))
+    logger.info(f'No regressions found comparing with the baseline {baseline_path}.')
 
 
 def update_build_file_version(old_version, new_version):
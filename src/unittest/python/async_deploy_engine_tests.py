@@ -0,0 +1,78 @@
+import threading
+import time
+import unittest
+from concurrent.futures import wait
+
+import databricks_pybuilder_plugin as plugin
+from fake_deployment import FakeDeployment
+
+ASYNC_ENGINE = {'deploy_engine': 'asyncio', 'async_concurrency': 32}
+
+
+class AsyncDeployEngineTests(unittest.TestCase):
+    def test_should_bound_calls_in_flight_by_pool_size(self):
+        engine = plugin._AsyncDeployEngine(2)
+        lock = threading.Lock()
+        in_flight = []
+        peak = []
+
+        def call():
+            with lock:
+                in_flight.append(1)
+                peak.append(len(in_flight))
+            time.sleep(0.01)
+            with lock:
+                in_flight.pop()
+
+        wait([engine.submit(call) for _ in range(8)])
+
+        self.assertEqual(2, max(peak))
+
+    def test_should_upload_notebooks_without_exhausting_connection_pool(self):
+        with FakeDeployment(files=120, **ASYNC_ENGINE) as deployment:
+            with self.assertNoLogs('urllib3.connectionpool', level='WARNING'):
+                deployment.run(plugin.export_workspace)
+
+            self.assertEqual(120, len(deployment.notebooks()))
+
+    def test_should_size_connection_pool_to_async_concurrency(self):
+        with FakeDeployment(**ASYNC_ENGINE) as deployment:
+            client = plugin._get_databricks_client(deployment.create_project(), 'dev')
+
+            self.assertEqual(32, client.session.get_adapter(deployment.server.host)._pool_maxsize)
+
+    def test_should_upload_resources(self):
+        with FakeDeployment(files=30, large_files=1, large_file_size=2 * 1024 * 1024,
+                            dbfs_large_file_threshold=1024 * 1024, **ASYNC_ENGINE) as deployment:
+            deployment.run(plugin.export_resources)
+
+            self.assertEqual(2 * 1024 * 1024, deployment.server.dbfs['/FileStore/project/dev/blob_0.bin'])
+            self.assertEqual(3, len([path for path in deployment.server.dbfs if path.endswith('.csv')]))
+
+    def test_should_reset_jobs(self):
+        with FakeDeployment(jobs=5, job_diff_only=True, **ASYNC_ENGINE) as deployment:
+            deployment.run(plugin.deploy_job)
+
+            for job in deployment.server.jobs.values():
+                self.assertEqual({'env': 'dev', 'branch': 'main'}, job['settings']['tags'])
+
+    def test_should_install_library_to_all_clusters(self):
+        with FakeDeployment(clusters=3, **ASYNC_ENGINE) as deployment:
+            deployment.run(plugin.install_library)
+
+            for cluster_id in deployment.server.clusters:
+                self.assertEqual(['/Volumes/project/libs/dev/main/benchmark_project-1.0.0-py3-none-any.whl'],
+                                 deployment.attached_libraries(cluster_id))
+
+    def test_should_deploy_all_envs(self):
+        with FakeDeployment(files=30, **ASYNC_ENGINE) as deployment:
+            credentials = {env: {'host': deployment.server.host, 'token': 'test'} for env in ('dev', 'qa')}
+            deployment.run(plugin.export_workspace, envs=['dev', 'qa'], databricks_credentials=credentials)
+
+            for env in ('dev', 'qa'):
+                self.assertEqual(30, len([notebook for notebook in deployment.notebooks()
+                                          if notebook.startswith(f'/project/{env}/')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
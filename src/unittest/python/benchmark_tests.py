@@ -0,0 +1,33 @@
+import os
+import unittest
+
+import boto3
+
+import databricks_pybuilder_plugin as plugin
+from databricks_pybuilder_benchmark import SCENARIOS, S3StandIn, run_scenario
+from fake_deployment import RecordingLogger
+
+
+class S3StandInTests(unittest.TestCase):
+    def test_should_restore_default_session_and_environment(self):
+        default_session = boto3.DEFAULT_SESSION
+        environ = dict(os.environ)
+
+        with S3StandIn(0, None):
+            self.assertIsNot(default_session, boto3.DEFAULT_SESSION)
+
+        self.assertIs(default_session, boto3.DEFAULT_SESSION)
+        self.assertEqual(environ, dict(os.environ))
+
+
+class RunScenarioTests(unittest.TestCase):
+    def test_should_measure_every_task_of_small_scenario(self):
+        result = run_scenario(plugin, 'small', SCENARIOS['small'], RecordingLogger(), trace_memory=False)
+
+        self.assertEqual(['export_workspace', 'export_resources', 'deploy_job', 'install_library'],
+                         [task['task'] for task in result['tasks']])
+        self.assertFalse([task for task in result['tasks'] if task.get('error')])
+
+
+if __name__ == '__main__':
+    unittest.main()
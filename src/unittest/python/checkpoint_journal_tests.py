@@ -0,0 +1,58 @@
+import os
+import unittest
+from unittest import mock
+
+import databricks_pybuilder_plugin as plugin
+from fake_deployment import FakeDeployment, RecordingLogger
+
+
+class CheckpointJournalTests(unittest.TestCase):
+    def setUp(self):
+        plugin._checkpoint_journals.clear()
+
+    def run_build(self, deployment, task, error_rate=0.0, logger=None, **overrides):
+        # every build is a new pyb process with its own journal
+        plugin._checkpoint_journals.clear()
+        deployment.server.error_rate = error_rate
+        try:
+            return deployment.run(task, logger, databricks_api_retries=0, **overrides)
+        finally:
+            deployment.server.error_rate = 0.0
+
+    def test_should_not_hash_uploaded_files(self):
+        with FakeDeployment(files=30) as deployment:
+            with mock.patch('databricks_pybuilder_plugin._file_sha256') as file_sha256:
+                self.run_build(deployment, plugin.export_workspace)
+                self.run_build(deployment, plugin.export_resources)
+
+            file_sha256.assert_not_called()
+
+    def test_should_resume_interrupted_upload(self):
+        with FakeDeployment(files=60, workspace_upload_workers=4) as deployment:
+            full_request_count = self.run_build(deployment, plugin.export_workspace)
+            with self.assertRaises(Exception):
+                self.run_build(deployment, plugin.export_workspace, error_rate=0.1)
+
+            resumed_request_count = self.run_build(deployment, plugin.export_workspace, resume=True)
+
+            self.assertLess(resumed_request_count, full_request_count)
+            self.assertEqual(60, len(deployment.notebooks()))
+
+    def test_should_upload_file_changed_since_interrupted_build(self):
+        with FakeDeployment(files=30) as deployment:
+            self.run_build(deployment, plugin.export_workspace)
+            notebook_path = os.path.join(deployment.basedir, 'src', 'main', 'scripts', 'module_0', 'package_0',
+                                         'notebook_0.py')
+            stat = os.stat(notebook_path)
+            os.utime(notebook_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+            logger = RecordingLogger()
+
+            self.run_build(deployment, plugin.export_workspace, logger=logger, resume=True)
+
+            uploaded_paths = [message for message in logger.messages if message.startswith('The file has been uploaded')]
+            self.assertEqual(['The file has been uploaded into /project/dev/main/module_0/package_0/notebook_0.'],
+                             uploaded_paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+
+from databricks_pybuilder_plugin import _ClusterStateWaiter
+
+
+class _Logger:
+    def __init__(self):
+        self.messages = []
+
+    def info(self, message, *args):
+        self.messages.append(message)
+
+    debug = warn = error = info
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+class _FakeClusterApi:
+    """
+    Returns the scripted states one per poll, the last state is repeated. A start request switches to the
+    scripted states after the start if they are given.
+    """
+
+    def __init__(self, states, states_after_start=None):
+        self.states = list(states)
+        self.states_after_start = states_after_start
+        self.start_requests = 0
+        self.polls = 0
+
+    def get_cluster(self, cluster_id):
+        self.polls += 1
+        state = self.states.pop(0) if len(self.states) > 1 else self.states[0]
+        return {'cluster_id': cluster_id, 'state': state, 'state_message': f'{state} message',
+                'termination_reason': {'code': 'CLOUD_FAILURE'} if state == 'TERMINATED' else None}
+
+    def start_cluster(self, cluster_id):
+        self.start_requests += 1
+        if self.states_after_start is not None:
+            self.states = list(self.states_after_start)
+
+
+class ClusterStateWaiterTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = _FakeClock()
+        self.logger = _Logger()
+
+    def create_waiter(self, cluster_api, timeout=300):
+        return _ClusterStateWaiter(cluster_api, 'cluster-1', timeout, self.logger, poll_interval=2,
+                                   max_poll_interval=30, clock=self.clock, sleep=self.clock.sleep, jitter=lambda: 1.0)
+
+    def test_should_return_immediately_if_running(self):
+        cluster_api = _FakeClusterApi(['RUNNING'])
+
+        self.assertEqual({}, self.create_waiter(cluster_api).wait_until_running())
+        self.assertEqual(0, cluster_api.start_requests)
+        self.assertEqual([], self.clock.sleeps)
+
+    def test_should_start_terminating_cluster_once_terminated(self):
+        cluster_api = _FakeClusterApi(['TERMINATING', 'TERMINATING', 'TERMINATED'],
+                                      states_after_start=['PENDING', 'PENDING', 'RUNNING'])
+
+        phase_durations = self.create_waiter(cluster_api).wait_until_running()
+
+        self.assertEqual(1, cluster_api.start_requests)
+        self.assertEqual(['TERMINATING', 'TERMINATED', 'PENDING'], list(phase_durations))
+        self.assertEqual(6.0, phase_durations['TERMINATING'])
+        self.assertEqual(6.0, phase_durations['PENDING'])
+
+    def test_should_double_poll_interval_within_state_up_to_maximum(self):
+        cluster_api = _FakeClusterApi(['PENDING'] * 6 + ['RUNNING'])
+
+        self.create_waiter(cluster_api).wait_until_running()
+
+        self.assertEqual([2.0, 4.0, 8.0, 16.0, 30.0, 30.0], self.clock.sleeps)
+
+    def test_should_fail_if_cluster_is_terminated_while_starting(self):
+        cluster_api = _FakeClusterApi(['TERMINATED'], states_after_start=['PENDING', 'PENDING', 'TERMINATED'])
+
+        with self.assertRaises(Exception) as error:
+            self.create_waiter(cluster_api).wait_until_running()
+
+        self.assertEqual(1, cluster_api.start_requests)
+        self.assertIn('has been terminated while starting', str(error.exception))
+        self.assertIn('CLOUD_FAILURE', str(error.exception))
+
+    def test_should_fail_on_error_state(self):
+        cluster_api = _FakeClusterApi(['PENDING', 'ERROR'])
+
+        with self.assertRaises(Exception) as error:
+            self.create_waiter(cluster_api).wait_until_running()
+
+        self.assertEqual('The state of the cluster cluster-1 cannot be handled: ERROR. ERROR message',
+                         str(error.exception))
+
+    def test_should_fail_on_timeout_without_oversleeping(self):
+        cluster_api = _FakeClusterApi(['PENDING'])
+        waiter = self.create_waiter(cluster_api, timeout=45)
+
+        with self.assertRaises(Exception) as error:
+            waiter.wait_until_running()
+
+        self.assertEqual('The cluster cluster-1 hasn\'t been started in 45 seconds...', str(error.exception))
+        self.assertEqual(45.0, self.clock.now)
+        self.assertEqual(45.0, waiter.phase_durations['PENDING'])
+
+    def test_should_log_state_transitions_only(self):
+        cluster_api = _FakeClusterApi(['PENDING', 'PENDING', 'PENDING', 'RUNNING'])
+
+        self.create_waiter(cluster_api).wait_until_running()
+
+        self.assertEqual(['The cluster cluster-1 is PENDING...', 'The cluster cluster-1 is RUNNING...'],
+                         self.logger.messages)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import unittest
+from base64 import b64decode
+from unittest import mock
+
+from databricks_pybuilder_plugin import _stream_file_to_dbfs
+
+
+class _Logger:
+    def __init__(self):
+        self.warnings = []
+
+    def info(self, message, *args):
+        pass
+
+    debug = info
+
+    def warn(self, message, *args):
+        self.warnings.append(message)
+
+    error = warn
+
+
+class _FakeDbfsService:
+    """
+    Keeps streamed files in memory. The listed add-block calls are applied and then fail like a timed out request.
+    """
+
+    def __init__(self, applied_then_failed_calls=(), failed_calls=()):
+        self.files = {}
+        self.handles = {}
+        self.closed_handles = []
+        self.add_block_calls = 0
+        self.applied_then_failed_calls = set(applied_then_failed_calls)
+        self.failed_calls = set(failed_calls)
+
+    def create(self, path, overwrite):
+        handle = len(self.handles) + 1
+        self.handles[handle] = (path, bytearray())
+        return {'handle': handle}
+
+    def add_block(self, handle, data):
+        self.add_block_calls += 1
+        if self.add_block_calls in self.failed_calls:
+            raise Exception('Injected failure.')
+        self.handles[handle][1].extend(b64decode(data))
+        if self.add_block_calls in self.applied_then_failed_calls:
+            raise Exception('Read timed out.')
+
+    def close(self, handle):
+        self.closed_handles.append(handle)
+        path, content = self.handles[handle]
+        self.files[path] = bytes(content)
+
+    def get_status(self, path):
+        return {'path': path, 'file_size': len(self.files[path])}
+
+
+class StreamFileToDbfsTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.local_path = os.path.join(self.directory, 'large.bin')
+        self.content = os.urandom(10 * 1024 + 17)
+        with open(self.local_path, 'wb') as file:
+            file.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def stream(self, service, logger=None):
+        with mock.patch('time.sleep'):
+            _stream_file_to_dbfs(service, self.local_path, 'dbfs:/FileStore/large.bin', 1024, 2, logger or _Logger(),
+                                 file_retries=1)
+
+    def test_should_stream_file_in_blocks(self):
+        service = _FakeDbfsService()
+
+        self.stream(service)
+
+        self.assertEqual(self.content, service.files['dbfs:/FileStore/large.bin'])
+        self.assertEqual(11, service.add_block_calls)
+
+    def test_should_restart_file_duplicated_by_retried_block(self):
+        service = _FakeDbfsService(applied_then_failed_calls=[3])
+        logger = _Logger()
+
+        self.stream(service, logger)
+
+        self.assertEqual(self.content, service.files['dbfs:/FileStore/large.bin'])
+        self.assertEqual(2, len(service.handles))
+        self.assertTrue(any('instead of' in warning for warning in logger.warnings))
+
+    def test_should_fail_if_file_size_never_matches(self):
+        service = _FakeDbfsService(applied_then_failed_calls=[3, 15])
+
+        with self.assertRaises(Exception) as error:
+            self.stream(service)
+
+        self.assertIn('remote file size', str(error.exception))
+
+    def test_should_close_handle_if_block_fails(self):
+        service = _FakeDbfsService(failed_calls=[2, 3, 4])
+
+        with self.assertRaises(Exception):
+            self.stream(service)
+
+        self.assertEqual([1], service.closed_handles)
+
+
+if __name__ == '__main__':
+    unittest.main()
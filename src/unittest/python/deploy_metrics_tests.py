@@ -0,0 +1,55 @@
+import unittest
+from base64 import b64encode
+
+from databricks_pybuilder_plugin import _DeployMetrics
+
+
+class DeployMetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.metrics = _DeployMetrics()
+        self.metrics.start_phase('export_resources')
+        self.perform_query = self.metrics.instrument_perform_query(lambda method, path, data={}, *args, **kwargs: {},
+                                                                   'dev')
+
+    def test_should_count_streamed_file_bytes_once(self):
+        block = b64encode(b'x' * 1024).decode()
+        with self.metrics.measure('dbfs stream', 'dbfs:/large.bin', 4096, composite=True):
+            self.perform_query('POST', '/dbfs/create', {'path': '/large.bin'})
+            for _ in range(4):
+                self.perform_query('POST', '/dbfs/add-block', {'handle': 1, 'data': block})
+            self.perform_query('POST', '/dbfs/close', {'handle': 1})
+
+        report = self.metrics.report()
+
+        self.assertEqual(4096, report['totals']['bytes'])
+        self.assertEqual(6, report['totals']['calls'])
+        self.assertEqual(0, report['call_types']['POST /dbfs/add-block']['bytes'])
+        self.assertEqual(4096, report['call_types']['dbfs stream']['bytes'])
+        self.assertEqual(1, report['call_types']['dbfs stream']['count'])
+
+    def test_should_count_multipart_put_bytes_by_composite_call(self):
+        with self.metrics.measure('dbfs cp', 'dbfs:/small.csv', 100, composite=True):
+            self.perform_query('POST', '/dbfs/put', {'path': '/small.csv', 'overwrite': True})
+
+        report = self.metrics.report()
+
+        self.assertEqual(100, report['totals']['bytes'])
+        self.assertEqual(1, report['totals']['calls'])
+
+    def test_should_count_workspace_import_content(self):
+        content = b64encode(b'# Databricks notebook source\n').decode()
+
+        self.perform_query('POST', '/workspace/import', {'path': '/notebook', 'content': content})
+
+        self.assertEqual(len(content), self.metrics.report()['totals']['bytes'])
+
+    def test_should_count_failed_calls(self):
+        with self.assertRaises(Exception):
+            with self.metrics.measure('POST /jobs/reset', 1):
+                raise Exception('Injected failure.')
+
+        self.assertEqual(1, self.metrics.report()['totals']['failed_calls'])
+
+
+if __name__ == '__main__':
+    unittest.main()
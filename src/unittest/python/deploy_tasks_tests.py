@@ -0,0 +1,379 @@
+import os
+import unittest
+from unittest import mock
+
+import boto3
+
+import databricks_pybuilder_plugin as plugin
+from databricks_pybuilder_benchmark import BENCHMARK_BUCKET
+from fake_deployment import FakeDeployment, RecordingLogger
+
+
+class ExportWorkspaceTests(unittest.TestCase):
+    def test_should_upload_notebooks_without_extensions(self):
+        with FakeDeployment(files=30, workspace_upload_workers=4) as deployment:
+            deployment.run(plugin.export_workspace)
+
+            notebooks = deployment.notebooks()
+            self.assertEqual(30, len(notebooks))
+            self.assertIn('/project/dev/main/module_0/package_0/notebook_0', notebooks)
+
+    def test_should_import_notebooks_as_single_archive(self):
+        with FakeDeployment(files=30, workspace_bulk_import=True) as deployment:
+            request_count = deployment.run(plugin.export_workspace)
+
+            self.assertEqual(30, len(deployment.notebooks()))
+            self.assertEqual(3, request_count)
+
+    def test_should_limit_encoded_archive_size(self):
+        with FakeDeployment(files=30, workspace_bulk_import=True) as deployment:
+            with mock.patch('databricks_pybuilder_plugin.b64encode', wraps=plugin.b64encode) as b64encode:
+                deployment.run(plugin.export_workspace)
+            archive_size = len(b64encode.call_args.args[0])
+
+        with FakeDeployment(files=30, workspace_bulk_import=True) as deployment:
+            logger = RecordingLogger()
+
+            # the zipped archive fits the limit, its base64 text doesn't
+            deployment.run(plugin.export_workspace, logger, workspace_archive_max_size=archive_size + 1)
+
+            self.assertTrue(any('exceeds' in message for message in logger.warnings))
+            self.assertEqual(30, len(deployment.notebooks()))
+
+    def test_should_import_files_one_by_one_into_existing_directory(self):
+        with FakeDeployment(files=30, workspace_bulk_import=True) as deployment:
+            deployment.run(plugin.export_workspace)
+            logger = RecordingLogger()
+
+            request_count = deployment.run(plugin.export_workspace, logger)
+
+            self.assertEqual(30, len(deployment.notebooks()))
+            self.assertEqual([], logger.warnings)
+            self.assertTrue(any('an archive can\'t overwrite it' in message for message in logger.messages))
+            self.assertLess(30, request_count)
+
+    def test_should_upload_only_changed_files_with_incremental_sync(self):
+        with FakeDeployment(files=30, incremental_sync=True) as deployment:
+            deployment.run(plugin.export_workspace)
+
+            self.assertEqual(1, deployment.run(plugin.export_workspace))
+
+    def test_should_skip_touched_unchanged_files_with_incremental_sync(self):
+        with FakeDeployment(files=30, incremental_sync=True) as deployment:
+            deployment.run(plugin.export_workspace)
+            unchanged_request_count = deployment.run(plugin.export_workspace)
+            notebook_path = os.path.join(deployment.basedir, 'src', 'main', 'scripts', 'module_0', 'package_0',
+                                         'notebook_0.py')
+            stat = os.stat(notebook_path)
+            os.utime(notebook_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+            self.assertEqual(unchanged_request_count, deployment.run(plugin.export_workspace))
+            plugin._file_hashes.clear()
+            with mock.patch('databricks_pybuilder_plugin._file_sha256') as file_sha256:
+                deployment.run(plugin.export_workspace)
+            file_sha256.assert_not_called()
+
+    def test_should_forget_removed_file_already_deleted_remotely(self):
+        with FakeDeployment(files=30, incremental_sync=True, delete_removed_files=True) as deployment:
+            deployment.run(plugin.export_workspace)
+            os.remove(os.path.join(deployment.basedir, 'src', 'main', 'scripts', 'module_0', 'package_0', 'notebook_0.py'))
+            del deployment.server.workspace['/project/dev/main/module_0/package_0/notebook_0']
+
+            deployment.run(plugin.export_workspace)
+
+            self.assertEqual(1, deployment.run(plugin.export_workspace))
+
+    def test_should_skip_excluded_files(self):
+        with FakeDeployment(files=30, upload_exclude_patterns=['module_1']) as deployment:
+            deployment.run(plugin.export_workspace)
+
+            notebooks = deployment.notebooks()
+            self.assertEqual(27, len(notebooks))
+            self.assertFalse(any('/module_1/' in notebook for notebook in notebooks))
+
+    def test_should_scan_tree_once_for_all_envs(self):
+        with FakeDeployment(files=30, workspace_upload_workers=4) as deployment:
+            credentials = {env: {'host': deployment.server.host, 'token': 'test'} for env in ('dev', 'qa', 'prod')}
+            with mock.patch('os.scandir', wraps=os.scandir) as single_env_scandir:
+                deployment.run(plugin.export_workspace)
+            with mock.patch('os.scandir', wraps=os.scandir) as fan_out_scandir:
+                deployment.run(plugin.export_workspace, envs=['dev', 'qa', 'prod'], databricks_credentials=credentials)
+
+            self.assertEqual(single_env_scandir.call_count, fan_out_scandir.call_count)
+            for env in ('dev', 'qa', 'prod'):
+                self.assertEqual(30, len([notebook for notebook in deployment.notebooks()
+                                          if notebook.startswith(f'/project/{env}/')]))
+
+
+class ExportResourcesTests(unittest.TestCase):
+    def test_should_upload_small_and_streamed_files(self):
+        with FakeDeployment(files=30, large_files=1, large_file_size=2 * 1024 * 1024, dbfs_upload_workers=4,
+                            dbfs_large_file_threshold=1024 * 1024) as deployment:
+            deployment.run(plugin.export_resources)
+
+            self.assertEqual(2 * 1024 * 1024, deployment.server.dbfs['/FileStore/project/dev/blob_0.bin'])
+            self.assertEqual(3, len([path for path in deployment.server.dbfs if path.endswith('.csv')]))
+
+    def test_should_reject_block_size_over_dbfs_limit(self):
+        with FakeDeployment(files=30, large_files=1, large_file_size=2 * 1024 * 1024,
+                            dbfs_large_file_threshold=1024 * 1024) as deployment:
+            with self.assertRaises(Exception) as error:
+                deployment.run(plugin.export_resources, dbfs_block_size=2 * 1024 * 1024)
+
+            self.assertIn('"dbfs_block_size" property must be between 1 and 1048576 bytes', str(error.exception))
+            self.assertNotIn('/FileStore/project/dev/blob_0.bin', deployment.server.dbfs)
+
+
+class DeployJobTests(unittest.TestCase):
+    def test_should_reset_jobs_with_rendered_settings(self):
+        with FakeDeployment(jobs=3, job_deploy_workers=2) as deployment:
+            deployment.run(plugin.deploy_job)
+
+            for job in deployment.server.jobs.values():
+                settings = job['settings']
+                self.assertEqual({'env': 'dev', 'branch': 'main'}, settings['tags'])
+                self.assertEqual('/project/dev/main/module_0/notebook',
+                                 settings['tasks'][0]['notebook_task']['notebook_path'])
+                self.assertEqual('/Volumes/project/libs/dev/main/benchmark_project-1.0.0-py3-none-any.whl',
+                                 settings['tasks'][0]['libraries'][0]['whl'])
+
+    def test_should_reset_only_changed_jobs(self):
+        with FakeDeployment(jobs=3, job_diff_only=True) as deployment:
+            deployment.run(plugin.deploy_job)
+            logger = RecordingLogger()
+
+            deployment.run(plugin.deploy_job, logger)
+
+            self.assertIn('\nChanged jobs (0): -', logger.messages)
+
+    def test_should_deploy_single_job(self):
+        with FakeDeployment(jobs=3) as deployment:
+            deployment.run(plugin.deploy_job, deploy_single_job='benchmark_job_1')
+
+            self.assertEqual([{'name': 'benchmark_job_0'}, {'name': 'benchmark_job_2'}],
+                             [deployment.server.jobs[job_id]['settings'] for job_id in (1, 3)])
+            self.assertIn('tags', deployment.server.jobs[2]['settings'])
+
+    def test_should_reset_recreated_job_with_cached_job_ids(self):
+        for job_diff_only in (False, True):
+            with self.subTest(job_diff_only=job_diff_only), \
+                    FakeDeployment(jobs=3, state_cache=True, job_diff_only=job_diff_only) as deployment:
+                deployment.run(plugin.deploy_job)
+                # the job is recreated with a new id after its id has been cached
+                deployment.server.jobs.pop(2)
+                deployment.server.jobs[10] = {'job_id': 10, 'settings': {'name': 'benchmark_job_1'}}
+                plugin._state_caches.clear()
+
+                deployment.run(plugin.deploy_job)
+
+                self.assertIn('tags', deployment.server.jobs[10]['settings'])
+                self.assertEqual(10, plugin._get_state_cache(deployment.create_project()).get(
+                    f'jobs/{deployment.server.host}')['benchmark_job_1'])
+
+    def test_should_upload_archive_removed_after_it_was_cached(self):
+        with FakeDeployment(jobs=1, state_cache=True) as deployment:
+            deployment.run(plugin.deploy_job)
+            s3_client = boto3.client('s3')
+            archive_key = 'libs/dev/main/benchmark_project-1.0.0-py3-none-any.whl'
+            s3_client.delete_object(Bucket=BENCHMARK_BUCKET, Key=archive_key)
+
+            deployment.run(plugin.deploy_job)
+
+            self.assertIn('sha256', s3_client.head_object(Bucket=BENCHMARK_BUCKET, Key=archive_key)['Metadata'])
+
+
+class PruneTests(unittest.TestCase):
+    def test_should_delete_orphaned_file_and_directory(self):
+        with FakeDeployment(files=30) as deployment:
+            deployment.run(plugin.export_workspace)
+            deployment.server.workspace.update({'/project/dev/main/module_0/removed_notebook': 'NOTEBOOK',
+                                                '/project/dev/main/removed_module': 'DIRECTORY',
+                                                '/project/dev/main/removed_module/notebook': 'NOTEBOOK'})
+
+            deployment.run(plugin.prune_workspace)
+
+            self.assertNotIn('/project/dev/main/module_0/removed_notebook', deployment.server.workspace)
+            self.assertNotIn('/project/dev/main/removed_module', deployment.server.workspace)
+            self.assertEqual(30, len(deployment.notebooks()))
+
+    def test_should_delete_remote_copies_of_excluded_files(self):
+        with FakeDeployment(files=30) as deployment:
+            deployment.run(plugin.export_workspace)
+
+            deployment.run(plugin.prune_workspace, upload_exclude_patterns=['module_1'])
+
+            self.assertNotIn('/project/dev/main/module_1', deployment.server.workspace)
+            self.assertEqual(27, len(deployment.notebooks()))
+
+    def test_should_keep_env_config_file(self):
+        with FakeDeployment(files=30) as deployment:
+            deployment.run(plugin.export_workspace)
+            deployment.server.workspace['/project/dev/main/env'] = 'NOTEBOOK'
+
+            deployment.run(plugin.prune_workspace, enable_env_sensitive_workspace_properties=True)
+
+            self.assertIn('/project/dev/main/env', deployment.server.workspace)
+            deployment.run(plugin.prune_workspace)
+            self.assertNotIn('/project/dev/main/env', deployment.server.workspace)
+
+    def test_should_delete_inactive_branches(self):
+        with FakeDeployment(files=30) as deployment:
+            deployment.run(plugin.export_workspace)
+            for branch in ('old_branch', 'feature/active', 'feature/stale'):
+                deployment.run(plugin.export_workspace, branch=branch)
+
+            deployment.run(plugin.prune_workspace, prune_active_branches=['feature/active'])
+
+            self.assertEqual({'feature', 'main'}, {notebook.split('/')[3] for notebook in deployment.notebooks()})
+            self.assertEqual(60, len(deployment.notebooks()))
+            self.assertNotIn('/project/dev/feature/stale', deployment.server.workspace)
+
+    def test_should_not_delete_anything_in_dry_run(self):
+        with FakeDeployment(files=30) as deployment:
+            deployment.run(plugin.export_workspace)
+            deployment.run(plugin.export_workspace, branch='old_branch')
+            deployment.server.workspace['/project/dev/main/removed_module'] = 'DIRECTORY'
+            deployment.server.dbfs['/FileStore/project/dev/removed.csv'] = 1
+            workspace, dbfs = dict(deployment.server.workspace), dict(deployment.server.dbfs)
+
+            deployment.run(plugin.prune_workspace, prune_dry_run=True, prune_active_branches=['main'])
+            deployment.run(plugin.prune_resources, prune_dry_run=True)
+
+            self.assertEqual(workspace, deployment.server.workspace)
+            self.assertEqual(dbfs, deployment.server.dbfs)
+
+    def test_should_delete_orphaned_resources(self):
+        with FakeDeployment(files=30) as deployment:
+            deployment.run(plugin.export_resources)
+            deployment.server.dbfs.update({'/FileStore/project/dev/removed.csv': 1,
+                                           '/FileStore/project/dev/removed': None,
+                                           '/FileStore/project/dev/removed/resource.csv': 1})
+
+            deployment.run(plugin.prune_resources)
+
+            self.assertEqual(['/FileStore/project/dev/resource_0.csv', '/FileStore/project/dev/resource_1.csv',
+                              '/FileStore/project/dev/resource_2.csv'],
+                             sorted(path for path in deployment.server.dbfs if path.startswith('/FileStore/project/dev/')))
+
+    def test_should_upload_pruned_file_restored_locally_with_incremental_sync(self):
+        with FakeDeployment(files=30, incremental_sync=True) as deployment:
+            deployment.run(plugin.export_workspace)
+            notebook_path = os.path.join(deployment.basedir, 'src', 'main', 'scripts', 'module_0', 'package_0',
+                                         'notebook_0.py')
+            os.rename(notebook_path, notebook_path + '.bak')
+            deployment.run(plugin.prune_workspace)
+            os.rename(notebook_path + '.bak', notebook_path)
+
+            deployment.run(plugin.export_workspace)
+
+            self.assertIn('/project/dev/main/module_0/package_0/notebook_0', deployment.notebooks())
+
+    def test_should_upload_pruned_branch_again_with_incremental_sync(self):
+        with FakeDeployment(files=30, incremental_sync=True) as deployment:
+            deployment.run(plugin.export_workspace, branch='feature/stale')
+            deployment.run(plugin.prune_workspace, prune_active_branches=['main'])
+
+            deployment.run(plugin.export_workspace, branch='feature/stale')
+
+            self.assertEqual(30, len(deployment.notebooks()))
+
+
+class InstallLibraryTests(unittest.TestCase):
+    def test_should_attach_archive_and_start_cluster(self):
+        with FakeDeployment() as deployment:
+            deployment.run(plugin.install_library)
+
+            self.assertEqual(['/Volumes/project/libs/dev/main/benchmark_project-1.0.0-py3-none-any.whl'],
+                             deployment.attached_libraries())
+            self.assertEqual('RUNNING', deployment.server.clusters['benchmark-cluster-id']['state'])
+
+    def test_should_replace_old_library_version(self):
+        with FakeDeployment(wait_for_library_install=True) as deployment:
+            deployment.run(plugin.install_library)
+            deployment.write_archive(b'next version', '1.0.1')
+
+            deployment.run(plugin.install_library)
+
+            self.assertEqual(['/Volumes/project/libs/dev/main/benchmark_project-1.0.1-py3-none-any.whl'],
+                             deployment.attached_libraries())
+
+    def test_should_skip_unchanged_library(self):
+        with FakeDeployment() as deployment:
+            deployment.run(plugin.install_library)
+            logger = RecordingLogger()
+
+            self.assertEqual(2, deployment.run(plugin.install_library, logger))
+            self.assertTrue(any('is already attached' in message for message in logger.messages))
+
+    def test_should_reinstall_rebuilt_archive_of_same_version_uploaded_by_deploy_job(self):
+        with FakeDeployment() as deployment:
+            deployment.run(plugin.install_library)
+            deployment.write_archive(b'rebuilt dev version')
+            deployment.run(plugin.deploy_job)
+            logger = RecordingLogger()
+
+            deployment.run(plugin.install_library, logger)
+
+            self.assertFalse(any('is already attached' in message for message in logger.messages))
+            self.assertTrue(any('The library has been attached' in message for message in logger.messages))
+
+    def test_should_reinstall_library_without_local_record(self):
+        with FakeDeployment() as deployment:
+            deployment.run(plugin.install_library)
+            os.remove(os.path.join(deployment.basedir, 'target', 'databricks_libraries.json'))
+            plugin._state_caches.clear()
+            logger = RecordingLogger()
+
+            deployment.run(plugin.install_library, logger)
+
+            self.assertTrue(any('The library has been attached' in message for message in logger.messages))
+
+    def test_should_reinstall_rebuilt_archive_uploaded_for_another_cluster(self):
+        with FakeDeployment(clusters=3, parallel_install_stages=True) as deployment:
+            deployment.run(plugin.install_library)
+            deployment.write_archive(b'rebuilt dev version')
+            # the s3 object already has the new content when the other clusters are checked
+            deployment.run(plugin.install_library, remote_cluster_name='benchmark_cluster')
+            logger = RecordingLogger()
+
+            deployment.run(plugin.install_library, logger)
+
+            statuses = {message.split()[1]: message.split()[2] for message in logger.messages
+                        if message.startswith('  benchmark_cluster')}
+            self.assertEqual('INSTALLED', statuses['benchmark-cluster-2-id'])
+            self.assertEqual('INSTALLED', statuses['benchmark-cluster-3-id'])
+
+    def test_should_install_to_every_cluster_sharing_matched_name(self):
+        with FakeDeployment(clusters=2) as deployment:
+            deployment.server.clusters['benchmark-cluster-2-id']['cluster_name'] = 'benchmark_cluster'
+
+            deployment.run(plugin.install_library)
+
+            for cluster_id in ('benchmark-cluster-id', 'benchmark-cluster-2-id'):
+                self.assertEqual(['/Volumes/project/libs/dev/main/benchmark_project-1.0.0-py3-none-any.whl'],
+                                 deployment.attached_libraries(cluster_id))
+
+    def test_should_install_to_recreated_cluster_with_cached_cluster_ids(self):
+        with FakeDeployment(state_cache=True) as deployment:
+            deployment.run(plugin.install_library)
+            # the cluster is recreated with a new id after its id has been cached
+            cluster = deployment.server.clusters.pop('benchmark-cluster-id')
+            deployment.server.clusters['new-cluster-id'] = dict(cluster, cluster_id='new-cluster-id', state='TERMINATED')
+            deployment.server.libraries['new-cluster-id'] = []
+            plugin._state_caches.clear()
+
+            deployment.run(plugin.install_library)
+
+            self.assertEqual(['/Volumes/project/libs/dev/main/benchmark_project-1.0.0-py3-none-any.whl'],
+                             deployment.attached_libraries('new-cluster-id'))
+
+    def test_should_fail_if_no_cluster_matches(self):
+        with FakeDeployment() as deployment:
+            with self.assertRaises(Exception) as error:
+                deployment.run(plugin.install_library, remote_cluster_name='missing_cluster')
+
+            self.assertIn('No clusters with name missing_cluster were found', str(error.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
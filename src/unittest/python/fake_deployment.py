@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+
+from pybuilder.core import Project
+
+import databricks_pybuilder_plugin as plugin
+from databricks_pybuilder_benchmark import FakeDatabricksServer, generate_project, S3StandIn, \
+    BENCHMARK_BUCKET, BENCHMARK_CLUSTER_NAME
+
+ENV = 'dev'
+BRANCH = 'main'
+
+
+class RecordingLogger:
+    def __init__(self):
+        self.messages = []
+        self.warnings = []
+
+    def debug(self, message, *args):
+        pass
+
+    def info(self, message, *args):
+        self.messages.append(message)
+
+    def warn(self, message, *args):
+        self.warnings.append(message)
+
+    error = warn
+
+
+class FakeDeployment:
+    """
+    A generated project deployed by the plugin tasks to the fake Databricks server and the moto s3 stand-in.
+    Every run creates a new project, like a new build does.
+    """
+
+    def __init__(self, files=10, large_files=0, large_file_size=0, jobs=3, clusters=1, **properties):
+        self.files = files
+        self.large_files = large_files
+        self.large_file_size = large_file_size
+        self.jobs = jobs
+        self.clusters = clusters
+        self.properties = properties
+        self.basedir = None
+        self.job_names = []
+        self.server = None
+        self._s3 = None
+
+    def __enter__(self):
+        self.basedir = tempfile.mkdtemp(prefix='databricks_deploy_tests_')
+        self.job_names = generate_project(self.basedir, self.files, self.large_files, self.large_file_size, self.jobs)
+        self.server = FakeDatabricksServer(cluster_start_time=0.1, jobs=self.job_names,
+                                           clusters=self.clusters).__enter__()
+        self._s3 = S3StandIn(0, None).__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self._s3.__exit__(*args)
+        self.server.__exit__(*args)
+        shutil.rmtree(self.basedir, ignore_errors=True)
+
+    def create_project(self, **overrides):
+        project = Project(self.basedir, name='benchmark_project')
+        plugin.initialize(project)
+        properties = {
+            'dir_target': 'target',
+            'dir_dist': 'target/dist',
+            'databricks_credentials': {ENV: {'host': self.server.host, 'token': 'test'}},
+            'env': ENV,
+            'branch': BRANCH,
+            'project_workspace_path': os.path.join(self.basedir, 'src', 'main', 'scripts') + os.sep,
+            'project_resources_path': os.path.join(self.basedir, 'src', 'main', 'resources') + os.sep,
+            'remote_workspace_path': '/project/{env}',
+            'with_dbfs_resources': True,
+            'dbfs_resources_path': 'dbfs:/FileStore/project/{env}',
+            'remote_cluster_name': f'{BENCHMARK_CLUSTER_NAME}*',
+            'attachable_lib_path': '/Volumes/project/libs/{env}/{branch}',
+            'attachable_lib_s3_path': f's3://{BENCHMARK_BUCKET}/libs/{{env}}/{{branch}}/',
+            'attachable_lib_envs': [ENV],
+            'cluster_poll_interval': 0.05,
+            'cluster_poll_max_interval': 0.1,
+            'deploy_report_path': None,
+        }
+        properties.update(self.properties)
+        properties.update(overrides)
+        for name, value in properties.items():
+            project.set_property(name, value)
+        return project
+
+    def run(self, task, logger=None, **overrides):
+        """
+        Runs the task in a new build and returns the number of requests it has sent to the Databricks api.
+        """
+        request_count = self.server.request_count
+        task(self.create_project(**overrides), logger or RecordingLogger())
+        return self.server.request_count - request_count
+
+    def write_archive(self, content, version='1.0.0'):
+        path = os.path.join(self.basedir, 'target', 'dist', 'dist', f'benchmark_project-{version}-py3-none-any.whl')
+        with open(path, 'wb') as file:
+            file.write(content)
+        return path
+
+    def notebooks(self):
+        return sorted(path for path, object_type in self.server.workspace.items() if object_type == 'NOTEBOOK')
+
+    def attached_libraries(self, cluster_id=None):
+        cluster_id = cluster_id or next(iter(self.server.clusters))
+        return [library['library']['whl'] for library in self.server.libraries[cluster_id]
+                if library['status'] != 'UNINSTALL_ON_RESTART']
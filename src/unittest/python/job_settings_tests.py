@@ -0,0 +1,46 @@
+import unittest
+
+from databricks_pybuilder_plugin import _is_job_settings_matching
+
+
+class JobSettingsMatchingTests(unittest.TestCase):
+    def test_should_match_settings_ignoring_key_order_and_empty_values(self):
+        local_settings = {'name': 'job', 'tasks': [{'task_key': 'a', 'libraries': []}], 'tags': {}}
+        remote_settings = {'tasks': [{'task_key': 'a'}], 'name': 'job', 'email_notifications': {}}
+
+        self.assertTrue(_is_job_settings_matching(local_settings, remote_settings))
+
+    def test_should_detect_changed_value(self):
+        self.assertFalse(_is_job_settings_matching({'name': 'job', 'max_retries': 2},
+                                                   {'name': 'job', 'max_retries': 1}))
+
+    def test_should_detect_setting_removed_from_definition(self):
+        remote_settings = {'name': 'job', 'schedule': {'quartz_cron_expression': '0 0 * * * ?',
+                                                       'timezone_id': 'UTC'}}
+
+        self.assertFalse(_is_job_settings_matching({'name': 'job'}, remote_settings))
+
+    def test_should_detect_nested_setting_removed_from_definition(self):
+        local_settings = {'name': 'job', 'tasks': [{'task_key': 'a'}]}
+        remote_settings = {'name': 'job', 'tasks': [{'task_key': 'a', 'email_notifications': {'on_failure': ['a@b.c']}}]}
+
+        self.assertFalse(_is_job_settings_matching(local_settings, remote_settings))
+
+    def test_should_ignore_defaults_filled_by_databricks(self):
+        local_settings = {'name': 'job', 'tasks': [{'task_key': 'a', 'notebook_task': {'notebook_path': '/n'}}]}
+        remote_settings = {'name': 'job', 'format': 'MULTI_TASK', 'max_concurrent_runs': 1, 'timeout_seconds': 0,
+                           'tasks': [{'task_key': 'a', 'run_if': 'ALL_SUCCESS', 'timeout_seconds': 0,
+                                      'notebook_task': {'notebook_path': '/n', 'source': 'WORKSPACE'}}]}
+
+        self.assertTrue(_is_job_settings_matching(local_settings, remote_settings))
+
+    def test_should_detect_non_default_value_of_default_setting(self):
+        self.assertFalse(_is_job_settings_matching({'name': 'job'}, {'name': 'job', 'max_concurrent_runs': 5}))
+
+    def test_should_detect_changed_task_count(self):
+        self.assertFalse(_is_job_settings_matching({'tasks': [{'task_key': 'a'}]},
+                                                   {'tasks': [{'task_key': 'a'}, {'task_key': 'b'}]}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import databricks_pybuilder_plugin as plugin
+from databricks_pybuilder_plugin import _read_job_definitions
+
+RENDERING_ARGS = {'env': 'dev', 'branch': 'main'}
+
+
+class JobTemplatesTests(unittest.TestCase):
+    def setUp(self):
+        self.template_dir = tempfile.mkdtemp(prefix='job_templates_tests_')
+        self.cache_dir = os.path.join(tempfile.mkdtemp(prefix='job_templates_cache_'), 'templates')
+
+    def tearDown(self):
+        shutil.rmtree(self.template_dir, ignore_errors=True)
+        shutil.rmtree(os.path.dirname(self.cache_dir), ignore_errors=True)
+
+    def write_template(self, name, content):
+        path = os.path.join(self.template_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def test_should_render_single_definition_file(self):
+        path = self.write_template('jobs.json', '[{"name": "job_a_{{ env }}"}, {"name": "job_b_{{ branch }}"}]')
+
+        self.assertEqual([{'name': 'job_a_dev'}, {'name': 'job_b_main'}], _read_job_definitions(path, RENDERING_ARGS))
+
+    def test_should_render_every_template_of_directory(self):
+        self.write_template('job_a.json', '{"name": "job_a", "tags": {"env": "{{ env }}"}}')
+        self.write_template('job_b.json', '[{"name": "job_b"}, {"name": "job_c"}]')
+        self.write_template('notes.txt', 'not a template')
+
+        self.assertEqual([{'name': 'job_a', 'tags': {'env': 'dev'}}, {'name': 'job_b'}, {'name': 'job_c'}],
+                         _read_job_definitions(self.template_dir, RENDERING_ARGS))
+
+    def test_should_include_sub_templates(self):
+        self.write_template('job_a.json', '{"name": "job_a", "tasks": [{% include "parts/task.json" %}]}')
+        self.write_template('parts/task.json', '{"task_key": "main", "notebook_task": {"notebook_path": "/{{ env }}"}}')
+
+        self.assertEqual([{'name': 'job_a', 'tasks': [{'task_key': 'main', 'notebook_task': {'notebook_path': '/dev'}}]}],
+                         _read_job_definitions(self.template_dir, RENDERING_ARGS))
+
+    def test_should_render_only_template_of_selected_job(self):
+        self.write_template('job_a.json', '{"name": "job_a"}')
+        # a broken template of another job isn't rendered
+        self.write_template('job_b.json', '{"name": {{ undefined_value.missing }}}')
+
+        self.assertEqual([{'name': 'job_a'}], _read_job_definitions(self.template_dir, RENDERING_ARGS, 'job_a'))
+
+    def test_should_render_every_template_if_none_is_named_after_selected_job(self):
+        self.write_template('jobs_a.json', '[{"name": "job_a"}, {"name": "job_b"}]')
+        self.write_template('jobs_c.json', '{"name": "job_c"}')
+
+        self.assertEqual([{'name': 'job_a'}, {'name': 'job_b'}, {'name': 'job_c'}],
+                         _read_job_definitions(self.template_dir, RENDERING_ARGS, 'job_b'))
+
+    def test_should_reuse_compiled_templates_from_bytecode_cache(self):
+        self.write_template('job_a.json', '{"name": "job_a_{{ env }}"}')
+
+        self.assertEqual([{'name': 'job_a_dev'}], _read_job_definitions(self.template_dir, RENDERING_ARGS,
+                                                                        cache_dir=self.cache_dir))
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+        # a new build starts with empty in-memory caches
+        plugin._jinja_environments.clear()
+        with mock.patch('jinja2.Environment.compile', side_effect=AssertionError('The template is compiled again.')):
+            self.assertEqual([{'name': 'job_a_qa'}], _read_job_definitions(self.template_dir, {'env': 'qa'},
+                                                                           cache_dir=self.cache_dir))
+
+    def test_should_compile_changed_template_again(self):
+        path = self.write_template('job_a.json', '{"name": "job_a"}')
+        _read_job_definitions(self.template_dir, RENDERING_ARGS, cache_dir=self.cache_dir)
+        plugin._jinja_environments.clear()
+        self.write_template('job_a.json', '{"name": "job_a_changed"}')
+        os.utime(path, (0, 0))
+
+        self.assertEqual([{'name': 'job_a_changed'}], _read_job_definitions(self.template_dir, RENDERING_ARGS,
+                                                                            cache_dir=self.cache_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+from unittest import mock
+
+from requests import HTTPError, Response
+
+from databricks_pybuilder_plugin import _RateLimiter, _call_with_retries, _is_rate_limited
+
+
+class _Logger:
+    def __init__(self):
+        self.warnings = []
+
+    def info(self, message, *args):
+        pass
+
+    def warn(self, message, *args):
+        self.warnings.append(message)
+
+    debug = error = info
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, delay):
+        if len(self.sleeps) > 100:
+            raise AssertionError('The rate limiter never lets the call through.')
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+def _http_error(status_code, headers=None):
+    response = Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return HTTPError(f'{status_code} error', response=response)
+
+
+class RateLimiterTests(unittest.TestCase):
+    def test_should_let_burst_of_rate_calls_through(self):
+        clock = _FakeClock()
+        limiter = _RateLimiter(5, clock, clock.sleep)
+
+        for _ in range(5):
+            limiter.acquire()
+
+        self.assertEqual([], clock.sleeps)
+
+    def test_should_wait_for_next_token(self):
+        clock = _FakeClock()
+        limiter = _RateLimiter(4, clock, clock.sleep)
+
+        for _ in range(6):
+            limiter.acquire()
+
+        self.assertAlmostEqual(0.5, clock.now)
+
+    def test_should_let_calls_through_with_rate_below_one(self):
+        clock = _FakeClock()
+        limiter = _RateLimiter(0.5, clock, clock.sleep)
+
+        for _ in range(3):
+            limiter.acquire()
+
+        self.assertAlmostEqual(4.0, clock.now)
+
+
+class CallWithRetriesTests(unittest.TestCase):
+    def test_should_retry_rate_limited_call_respecting_retry_after(self):
+        responses = [_http_error(429, {'Retry-After': '7'}), _http_error(503), 'done']
+
+        def call():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        with mock.patch('time.sleep') as sleep:
+            result = _call_with_retries(call, 3, 'reset the job', _Logger(), is_retryable=_is_rate_limited)
+
+        self.assertEqual('done', result)
+        self.assertEqual([mock.call(7.0), mock.call(2.0)], sleep.call_args_list)
+
+    def test_should_not_retry_other_errors(self):
+        call = mock.Mock(side_effect=_http_error(400))
+
+        with mock.patch('time.sleep'), self.assertRaises(HTTPError):
+            _call_with_retries(call, 3, 'reset the job', _Logger(), is_retryable=_is_rate_limited)
+
+        self.assertEqual(1, call.call_count)
+
+    def test_should_raise_last_error_after_retries(self):
+        call = mock.Mock(side_effect=_http_error(503))
+
+        with mock.patch('time.sleep'), self.assertRaises(HTTPError):
+            _call_with_retries(call, 2, 'reset the job', _Logger(), is_retryable=_is_rate_limited)
+
+        self.assertEqual(3, call.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from databricks_pybuilder_plugin import _upload_archive, _is_s3_object_identical, _get_archive_sha256
+
+BUCKET_NAME = 'deploy-bucket'
+LIBRARY_S3_PATH = f's3://{BUCKET_NAME}/libs/dev/main/'
+
+
+class _Logger:
+    def __init__(self):
+        self.warnings = []
+
+    def info(self, message, *args):
+        pass
+
+    debug = info
+
+    def warn(self, message, *args):
+        self.warnings.append(message)
+
+    error = warn
+
+
+@mock_aws
+class UploadArchiveTests(unittest.TestCase):
+    def setUp(self):
+        self.environment = mock.patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'testing',
+                                                        'AWS_SECRET_ACCESS_KEY': 'testing',
+                                                        'AWS_DEFAULT_REGION': 'us-east-1'})
+        self.environment.start()
+        self.s3_client = boto3.client('s3')
+        self.s3_client.create_bucket(Bucket=BUCKET_NAME)
+        self.directory = tempfile.mkdtemp()
+        self.archive_path = os.path.join(self.directory, 'project-0.1.0-py3-none-any.whl')
+        self.write_archive(b'first build')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        self.environment.stop()
+
+    def write_archive(self, content):
+        with open(self.archive_path, 'wb') as file:
+            file.write(content)
+
+    def upload(self, logger=None, s3_client=None, clean_attachable_lib=False):
+        with mock.patch('databricks_pybuilder_plugin._get_s3_client', return_value=s3_client or self.s3_client), \
+                mock.patch.object(self.s3_client, 'upload_file', wraps=self.s3_client.upload_file) as upload_file:
+            _upload_archive(LIBRARY_S3_PATH, self.archive_path, clean_attachable_lib, None, logger or _Logger())
+        return upload_file.call_count
+
+    def remote_content(self):
+        return self.s3_client.get_object(Bucket=BUCKET_NAME,
+                                         Key='libs/dev/main/project-0.1.0-py3-none-any.whl')['Body'].read()
+
+    def test_should_upload_missing_archive_with_sha256_tag(self):
+        self.assertEqual(1, self.upload())
+
+        remote_object = self.s3_client.head_object(Bucket=BUCKET_NAME, Key='libs/dev/main/project-0.1.0-py3-none-any.whl')
+        self.assertEqual(_get_archive_sha256(self.archive_path), remote_object['Metadata']['sha256'])
+
+    def test_should_skip_identical_archive(self):
+        self.upload()
+
+        self.assertEqual(0, self.upload())
+
+    def test_should_upload_changed_archive_of_same_name(self):
+        self.upload()
+        self.write_archive(b'second build')
+
+        self.assertEqual(1, self.upload())
+        self.assertEqual(b'second build', self.remote_content())
+
+    def test_should_clean_library_folder(self):
+        self.s3_client.put_object(Bucket=BUCKET_NAME, Key='libs/dev/main/project-0.0.9-py3-none-any.whl', Body=b'old')
+
+        self.upload(clean_attachable_lib=True)
+
+        keys = [item['Key'] for item in self.s3_client.list_objects_v2(Bucket=BUCKET_NAME)['Contents']]
+        self.assertEqual(['libs/dev/main/project-0.1.0-py3-none-any.whl'], keys)
+
+    def test_should_upload_if_head_request_is_forbidden(self):
+        logger = _Logger()
+        forbidden = ClientError({'Error': {'Code': '403', 'Message': 'Forbidden'}}, 'HeadObject')
+
+        with mock.patch.object(self.s3_client, 'head_object', side_effect=forbidden):
+            self.assertEqual(1, self.upload(logger))
+
+        self.assertEqual(b'first build', self.remote_content())
+        self.assertTrue(any('can\'t be verified' in warning for warning in logger.warnings))
+
+    def test_should_raise_other_head_request_errors(self):
+        throttled = ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Slow down'}}, 'HeadObject')
+
+        with mock.patch.object(self.s3_client, 'head_object', side_effect=throttled):
+            with self.assertRaises(ClientError):
+                self.upload()
+
+    def test_should_compare_etag_of_untagged_object(self):
+        self.s3_client.put_object(Bucket=BUCKET_NAME, Key='libs/dev/main/project-0.1.0-py3-none-any.whl',
+                                  Body=b'first build')
+
+        self.assertTrue(_is_s3_object_identical(self.s3_client, BUCKET_NAME,
+                                                'libs/dev/main/project-0.1.0-py3-none-any.whl', self.archive_path,
+                                                _get_archive_sha256(self.archive_path)))
+
+
+if __name__ == '__main__':
+    unittest.main()